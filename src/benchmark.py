@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+
+# This software is licensed under GPL-3.0
+# Copyright (c) 2026 The osloc2json contributors
+
+# Time the phases of osloc2json.py on the example licenses and on synthetic checklists of growing size
+
+import argparse
+import gc
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import osloc2json
+
+phases = ['parse', 'upgrade', 'expand', 'optimize', 'merge', 'lrefs', 'unify', 'uniq', 'render', 'serialize']
+
+usecasenames = ['Source code delivery', 'Binary delivery', 'Network service', 'Interactive display']
+verbs = ['Provide', 'Forward', 'Display', 'Reference', 'Include', 'Notify', 'Grant', 'Use']
+notverbs = ['Modify', 'Restrict', 'Remove', 'Promote']
+objects = ['Copyright notices', 'License text', 'Warranty disclaimer', 'Source code', 'Modification notice',
+  'Written offer', 'License notice', 'Patent license', 'Installation information', 'Acknowledgement']
+attributes = ['Highlighted', 'Appropriately', 'Machine-readable', 'Customary medium', 'No charge', 'Via Internet']
+conditions = ['Software modification', 'Source code On same server', 'Source code On other server',
+  'Binary delivery Via peer-to-peer transmission', 'Interactive AND Displaying License announcement']
+
+# Obligations added to every use case of an upgraded license, as licenseupgraderules.json does
+upgradeobligations = ['Use GPL-3.0-or-later License']
+
+def pick(rnd, pool, n, k):
+    """ Return k different names out of the first n of a pool, numbered beyond its end """
+    names = []
+    for i in rnd.sample(range(max(n, k)), k):
+        if i < len(pool):
+            names.append(pool[i])
+        else:
+            names.append('%s %d' % (pool[i % len(pool)], i // len(pool)))
+    return names
+
+def mkobligations(rnd, lines, tabs, n, vocabulary):
+    """ Append n obligations with up to two attributes to the lines of a checklist """
+    for obligation in pick(rnd, objects, vocabulary, n):
+        if rnd.random() < 0.25:
+            lines.append('\t' * tabs + 'YOU MUST NOT %s %s' % (rnd.choice(notverbs), obligation))
+        else:
+            lines.append('\t' * tabs + 'YOU MUST %s %s' % (rnd.choice(verbs), obligation))
+            for attribute in rnd.sample(attributes, rnd.randint(0, 2)):
+                lines.append('\t' * (tabs + 1) + 'ATTRIBUTE ' + attribute)
+
+def mkblock(rnd, lines, tabs, obligations, eithers, eitherifs, depth, alternatives, vocabulary):
+    """ Append a block of obligations, EITHER/OR and EITHER IF/OR IF chains to the lines of a checklist
+
+        Chains nest up to depth levels, nested blocks have two obligations and one chain of each kind, so that the
+        size of a checklist grows linearly with the number of obligations and chains. """
+    mkobligations(rnd, lines, tabs, obligations, vocabulary)
+    if depth == 0:
+        return
+    for i in range(eithers):
+        for j in range(alternatives):
+            if j == 0:
+                lines.append('\t' * tabs + 'EITHER')
+            else:
+                lines.append('\t' * tabs + 'OR')
+            mkblock(rnd, lines, tabs + 1, 2, 1, 1, depth - 1, alternatives, vocabulary)
+    for i in range(eitherifs):
+        for j, condition in enumerate(pick(rnd, conditions, alternatives, alternatives)):
+            if j == 0:
+                lines.append('\t' * tabs + 'EITHER IF ' + condition)
+            else:
+                lines.append('\t' * tabs + 'OR IF ' + condition)
+            mkblock(rnd, lines, tabs + 1, 2, 1, 1, depth - 1, alternatives, vocabulary)
+
+def mkchecklist(rnd, licensenames, usecases, obligations, eithers, eitherifs, depth, alternatives):
+    """ Return the text of a synthetic OSLOC checklist """
+    lines = []
+    for usecase in pick(rnd, usecasenames, usecases, usecases):
+        lines.append('USE CASE ' + usecase)
+        mkblock(rnd, lines, 1, obligations, eithers, eitherifs, depth, alternatives, 2 * obligations)
+    for licensename in rnd.sample(licensenames, len(licensenames) // 2):
+        lines.append('COMPATIBILITY ' + licensename)
+    if rnd.random() < 0.5:
+        lines.append('PATENT HINTS Yes')
+    if rnd.random() < 0.5:
+        lines.append('COPYLEFT CLAUSE Yes')
+    return '\n'.join(lines) + '\n'
+
+def mkcorpus(seed, licenses, usecases, obligations, eithers, eitherifs, depth, alternatives):
+    """ Return a dict of license names and texts of synthetic OSLOC checklists """
+    rnd = random.Random(seed)
+    licensenames = ['Synthetic-%d' % i for i in range(licenses)]
+    corpus = {}
+    for licensename in licensenames:
+        corpus[licensename] = mkchecklist(rnd, licensenames, usecases, obligations, eithers, eitherifs, depth, alternatives)
+    return corpus
+
+def readcorpus(directory):
+    """ Return a dict of license names and texts of the OSLOC files in a directory """
+    corpus = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.txt') and '+' not in filename:
+            oslocfile = open(os.path.join(directory, filename), 'r')
+            corpus[filename[:-4]] = oslocfile.read()
+            oslocfile.close()
+    return corpus
+
+def parsecorpus(corpus):
+    """ Parse the texts of a corpus with chain counters continued from license to license, as osloc2json.py does """
+    eitherchains = {}
+    eitherifchains = {}
+    licenses = {}
+    for licensename, text in corpus.items():
+        licenses[licensename] = {}
+        osloc2json.parseosloc(io.StringIO(text), licensename, licenses[licensename], eitherchains, eitherifchains, 2, False, False)
+    return licenses
+
+def bestof(repeat, setup, run):
+    """ Return the shortest time in ms of repeat calls of run with a new result of setup, garbage collection disabled """
+    best = None
+    for i in range(repeat):
+        arg = setup()
+        gcenabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run(arg)
+            elapsed = (time.perf_counter() - start) * 1000
+        finally:
+            if gcenabled:
+                gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchmarkcorpus(corpus, repeat, unifyrules, format):
+    """ Return the times in ms of the phases for a corpus, None for phases that cannot be timed """
+    licenses = parsecorpus(corpus)
+    merged = osloc2json.mergelicenses(list(licenses.values()), False)
+    times = {}
+
+    def upgrade(licenses):
+        for license in licenses.values():
+            osloc2json.upgradelicense(license, upgradeobligations)
+
+    def lrefs(merged):
+        osloc2json.addlrefs(merged, osloc2json.mklicenserefs(merged, licenses))
+
+    def render(licenses):
+        for license in licenses.values():
+            osloc2json.renderchecklist(license)
+
+    times['parse'] = bestof(repeat, lambda: corpus, parsecorpus)
+    times['upgrade'] = bestof(repeat, lambda: osloc2json.clonejson(licenses), upgrade)
+    times['expand'] = bestof(repeat, lambda: osloc2json.clonejson(licenses), lambda l: osloc2json.expandor(l, ''))
+    times['optimize'] = bestof(repeat, lambda: osloc2json.clonejson(licenses), osloc2json.optjson)
+    if len(licenses) > 1:
+        times['merge'] = bestof(repeat, lambda: list(licenses.values()), lambda l: osloc2json.mergelicenses(l, False))
+        times['lrefs'] = bestof(repeat, lambda: merged, lrefs)
+        if unifyrules is not None:
+            times['unify'] = bestof(repeat, lambda: osloc2json.clonejson(merged), lambda l: osloc2json.unifylicenses(l, unifyrules))
+        else:
+            times['unify'] = None
+        times['uniq'] = bestof(repeat, lambda: osloc2json.clonejson(merged), osloc2json.uniq)
+    else:
+        for phase in ['merge', 'lrefs', 'unify', 'uniq']:
+            times[phase] = None
+    times['render'] = bestof(repeat, lambda: licenses, render)
+    times['serialize'] = bestof(repeat, lambda: {'OSADL OSLOC': licenses}, lambda l: osloc2json.dumpjson(l, format))
+    return times
+
+def exponents(results, sizes):
+    """ Return the growth exponent of every phase over the synthetic corpora, fitted to the number of lines by least squares """
+    points = {}
+    for size in sizes:
+        result = results[str(size)]
+        for phase in phases:
+            if result['times'][phase] is not None:
+                points.setdefault(phase, []).append((math.log(result['lines']), math.log(max(result['times'][phase], 0.001))))
+    exps = {}
+    for phase, xy in points.items():
+        if len(xy) < 2:
+            continue
+        meanx = sum(x for x, y in xy) / len(xy)
+        meany = sum(y for x, y in xy) / len(xy)
+        sxx = sum((x - meanx) ** 2 for x, y in xy)
+        if sxx > 0:
+            exps[phase] = round(sum((x - meanx) * (y - meany) for x, y in xy) / sxx, 2)
+    return exps
+
+def printresults(baseline):
+    """ Print the times of all corpora as table """
+    print('%-10s %8s' % ('corpus', 'lines') + ''.join(' %9s' % phase for phase in phases))
+    for corpus, result in baseline['results'].items():
+        times = ''
+        for phase in phases:
+            if result['times'][phase] is None:
+                times += ' %9s' % '-'
+            else:
+                times += ' %9.2f' % result['times'][phase]
+        print('%-10s %8d' % (corpus, result['lines']) + times)
+    if len(baseline['exponents']) > 0:
+        print('%-19s' % 'exponent' + ''.join(' %9s' % baseline['exponents'].get(phase, '-') for phase in phases))
+    print('Times in ms, best of %d runs' % baseline['config']['repeat'])
+
+def compare(baseline, previous, tolerance, slack, mintime):
+    """ Print the phases that are slower than in a previous baseline, or grow faster with the size, return their number """
+    if baseline['config'] != previous['config']:
+        print('Baseline was recorded with different settings, cannot compare')
+        return 1
+    regressions = 0
+    for corpus, result in baseline['results'].items():
+        if corpus not in previous['results']:
+            continue
+        for phase in phases:
+            new = result['times'][phase]
+            old = previous['results'][corpus]['times'].get(phase)
+            if new is None or old is None:
+                continue
+            if new > old * tolerance and new - old > mintime:
+                print('Regression in phase %r of corpus %r: %.2f ms, baseline %.2f ms' % (phase, corpus, new, old))
+                regressions += 1
+    for phase, new in baseline['exponents'].items():
+        old = previous['exponents'].get(phase)
+        if old is not None and new > old + slack:
+            print('Regression in growth of phase %r: exponent %.2f, baseline %.2f' % (phase, new, old))
+            regressions += 1
+    return regressions
+
+def main():
+    exampledir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+    parser = argparse.ArgumentParser(prog = 'benchmark.py', formatter_class = argparse.RawTextHelpFormatter,
+        description = 'Time the phases of osloc2json.py on the example licenses and on synthetic checklists of growing size')
+    parser.add_argument('--licenses',
+      type = int,
+      metavar = 'N',
+      default = 8,
+      help = 'number of synthetic licenses, default 8')
+    parser.add_argument('--usecases',
+      type = int,
+      metavar = 'N',
+      default = 2,
+      help = 'number of use cases per synthetic license, default 2')
+    parser.add_argument('--obligations',
+      type = int,
+      metavar = 'N',
+      default = 8,
+      help = 'number of obligations per use case at size 1, default 8')
+    parser.add_argument('--eithers',
+      type = int,
+      metavar = 'N',
+      default = 2,
+      help = 'number of EITHER/OR chains per use case at size 1, default 2')
+    parser.add_argument('--eitherifs',
+      type = int,
+      metavar = 'N',
+      default = 1,
+      help = 'number of EITHER IF/OR IF chains per use case at size 1, default 1')
+    parser.add_argument('--depth',
+      type = int,
+      metavar = 'N',
+      default = 2,
+      help = 'nesting depth of chains, default 2')
+    parser.add_argument('--alternatives',
+      type = int,
+      metavar = 'N',
+      default = 2,
+      help = 'number of alternatives per chain, default 2')
+    parser.add_argument('--sizes',
+      metavar = 'LIST',
+      default = '1,2,4,8',
+      help = 'comma-separated sizes of the synthetic corpora, multiplying the numbers of obligations and chains, default "1,2,4,8"')
+    parser.add_argument('--seed',
+      type = int,
+      metavar = 'N',
+      default = 0,
+      help = 'seed of the synthetic licenses, default 0')
+    parser.add_argument('--repeat',
+      type = int,
+      metavar = 'N',
+      default = 3,
+      help = 'number of runs per phase, the shortest is taken, default 3')
+    parser.add_argument('--examples',
+      metavar = 'DIR',
+      default = exampledir,
+      help = 'directory of OSLOC files to time along with the synthetic licenses, "" for none, default "examples"')
+    parser.add_argument('--unifyrules',
+      metavar = 'FILE',
+      default = os.path.join(os.path.dirname(exampledir), 'unifyrules.json'),
+      help = 'unify rules to time the unify phase with, default "unifyrules.json"')
+    parser.add_argument('--format',
+      choices = osloc2json.JSONWriter.formats,
+      metavar = 'FORMAT',
+      default = 'indent',
+      help = 'format to time the serialize phase with, default "indent"')
+    parser.add_argument('--save',
+      metavar = 'FILE',
+      help = 'save the times as baseline in JSON format')
+    parser.add_argument('--compare',
+      metavar = 'FILE',
+      help = 'compare the times with a saved baseline, exit with 1 in case of regressions')
+    parser.add_argument('--tolerance',
+      type = float,
+      metavar = 'FACTOR',
+      default = 1.5,
+      help = 'factor by which a phase may be slower than in the baseline, default 1.5')
+    parser.add_argument('--slack',
+      type = float,
+      metavar = 'EXPONENT',
+      default = 0.3,
+      help = 'amount by which the growth exponent of a phase may exceed that of the baseline, default 0.3')
+    parser.add_argument('--mintime',
+      type = float,
+      metavar = 'MS',
+      default = 1.0,
+      help = 'slowdown in ms below which a phase is not reported as regression, default 1.0')
+    parser.add_argument('--generate',
+      metavar = 'DIR',
+      help = 'write the synthetic licenses of the largest size as OSLOC files to DIR instead of timing them')
+    args = parser.parse_args()
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(',')]
+    except ValueError:
+        parser.error('Sizes must be comma-separated integers')
+
+    config = {}
+    for option in ['licenses', 'usecases', 'obligations', 'eithers', 'eitherifs', 'depth', 'alternatives', 'seed', 'repeat', 'format']:
+        config[option] = getattr(args, option)
+    config['sizes'] = sizes
+
+    def synthetic(size):
+        return mkcorpus(args.seed, args.licenses, args.usecases, args.obligations * size, args.eithers * size,
+          args.eitherifs * size, args.depth, args.alternatives)
+
+    if args.generate:
+        os.makedirs(args.generate, exist_ok = True)
+        for licensename, text in synthetic(max(sizes)).items():
+            oslocfile = open(os.path.join(args.generate, licensename + '.txt'), 'w')
+            oslocfile.write(text)
+            oslocfile.close()
+        return
+
+    unifyrules = None
+    if args.unifyrules:
+        try:
+            rulesfile = open(args.unifyrules, 'r')
+        except:
+            print('Unify rules %r not opened, not timing the unify phase' % args.unifyrules)
+        else:
+            unifyrules = osloc2json.UnifyRules(json.load(rulesfile))
+            rulesfile.close()
+
+    corpora = {}
+    if args.examples:
+        corpora['examples'] = readcorpus(args.examples)
+    for size in sizes:
+        corpora[str(size)] = synthetic(size)
+
+    baseline = {'python': platform.python_version(), 'config': config, 'results': {}}
+    for name, corpus in corpora.items():
+        lines = sum(text.count('\n') for text in corpus.values())
+        baseline['results'][name] = {'lines': lines, 'times': benchmarkcorpus(corpus, args.repeat, unifyrules, args.format)}
+    baseline['exponents'] = exponents(baseline['results'], sizes)
+    printresults(baseline)
+
+    if args.save:
+        savefile = open(args.save, 'w')
+        json.dump(baseline, savefile, indent = 4, sort_keys = True)
+        savefile.write('\n')
+        savefile.close()
+
+    if args.compare:
+        try:
+            previousfile = open(args.compare, 'r')
+        except:
+            print('Baseline %r not opened, cannot compare' % args.compare)
+            sys.exit(1)
+        previous = json.load(previousfile)
+        previousfile.close()
+        if compare(baseline, previous, args.tolerance, args.slack, args.mintime) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
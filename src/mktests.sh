@@ -55,6 +55,17 @@ then
 fi
 rm -f examples/GPL-3.0-or-later.json
 
+# Forward conversion v2 with cold and warm parse cache, and without it
+for i in --cachedir=parsecache --cachedir=parsecache --no-cache
+do
+  ./src/osloc2json.py $i examples/GPL-3.0-or-later.txt
+  if ! cmp examples/GPL-3.0-or-later.json examples/GPL-3.0-or-later-reference.json
+  then
+    exit 1
+  fi
+done
+rm -Rf examples/GPL-3.0-or-later.json parsecache
+
 # Reverse conversion v2
 ./src/osloc2json.py -r examples/GPL-3.0-or-later.txt >recreated.checklist
 mv recreated.checklist GPL-3.0-or-later.txt
@@ -65,6 +76,34 @@ then
 fi
 rm -f examples/GPL-3.0-or-later.json GPL-3.0-or-later.*
 
+# Library API
+if ! python3 -c "
+import json, sys
+sys.path.insert(0, 'src')
+import osloc2json
+license = osloc2json.parsechecklist(open('examples/GPL-3.0-or-later.txt').read(), 'GPL-3.0-or-later')
+reference = json.load(open('examples/GPL-3.0-or-later-reference.json'))['GPL-3.0-or-later']
+sys.exit(license != reference or osloc2json.parsechecklist(osloc2json.renderchecklist(license)) != reference)
+"
+then
+  exit 1
+fi
+
+# Unify rules
+if ! python3 -c "
+import sys
+sys.path.insert(0, 'src')
+import osloc2json
+try:
+    osloc2json.UnifyRules({'Provide License text': ['Forward License text'], 'Forward License text': ['Provide License text']})
+except osloc2json.OSLOCError:
+    sys.exit(0)
+sys.exit(1)
+"
+then
+  exit 1
+fi
+
 # Merging v1
 ./src/osloc2json.py -1 examples/Apache-2.0.txt examples/GPL-3.0-or-later.txt
 if ! cmp examples/Apache-2.0+GPL-3.0-or-later-concatenated-v1.json osloc.json
@@ -100,6 +139,17 @@ then
   exit 1
 fi
 
+# Merge with cold and warm cache of merged licenses
+for i in 1 2
+do
+  ./src/osloc2json.py --cachedir=mergecache -m examples/CHECKLIST-2.0.txt examples/CHECKLIST-3.0.txt
+  if ! cmp examples/CHECKLIST-2.0+CHECKLIST-3.0.json merged.json
+  then
+    exit 1
+  fi
+done
+rm -Rf mergecache
+
 ./src/osloc2json.py -m examples/CHECKLIST-2.0.txt examples/CHECKLIST-4.0.txt
 if ! cmp examples/CHECKLIST-2.0+CHECKLIST-4.0.json merged.json
 then
@@ -159,6 +209,176 @@ then
 fi
 rm -f CHECKLIST-2.0+CHECKLIST-6.0.json
 
+# Batch recreation of checklists
+./src/osloc2json.py -r --checklistdir checklists -f checklists.json examples/CHECKLIST-2.0+CHECKLIST-4.0.json examples/CHECKLIST-2.0+CHECKLIST-5.0.json examples/CHECKLIST-2.0+CHECKLIST-6.0.json
+for i in 4 5 6
+do
+  if ! cmp examples/CHECKLIST-2.0+CHECKLIST-$i.0-reference.txt checklists/CHECKLIST-2.0+CHECKLIST-$i.0.checklist
+  then
+    diff -u examples/CHECKLIST-2.0+CHECKLIST-$i.0-reference.txt checklists/CHECKLIST-2.0+CHECKLIST-$i.0.checklist
+    exit 1
+  fi
+done
+./src/osloc2json.py -r --checklistformat markdown --checklistdir checklists -f checklists.json examples/CHECKLIST-2.0+CHECKLIST-4.0.json
+if test `grep -c '^ *- ' checklists/CHECKLIST-2.0+CHECKLIST-4.0.md` != `grep -c . examples/CHECKLIST-2.0+CHECKLIST-4.0-reference.txt`
+then
+  exit 1
+fi
+rm -Rf checklists checklists.json
+
+# License index and queries
+./src/osloc2json.py --index index.json examples/GPL-2.0-only.txt examples/MIT.txt examples/AGPL-3.0-only.txt examples/Apache-2.0.txt
+if test "`./src/osloc2json.py --query 'Binary delivery:YOU MUST=Provide Copyright notices' index.json`" != '["AGPL-3.0-only", "GPL-2.0-only", "MIT"]'
+then
+  exit 1
+fi
+if test "`./src/osloc2json.py --query 'COPYLEFT CLAUSE=Yes' --query 'COMPATIBILITY=Apache-2.0' index.json`" != '["AGPL-3.0-only"]'
+then
+  exit 1
+fi
+if test "`./src/osloc2json.py --query 'USE CASE=Network service' index.json`" != '["AGPL-3.0-only"]'
+then
+  exit 1
+fi
+rm -f index.json
+
+# Merge by the server
+./src/osloc2json.py --serve 0 --jobs 2 examples >server.log &
+serverpid=$!
+for i in 1 2 3 4 5 6 7 8 9 10
+do
+  port=`sed -n 's,^Serving .* at http://127.0.0.1:\([0-9]*\)/$,\1,p' server.log`
+  if test -n "$port" && curl -s "http://127.0.0.1:$port/merge?license=CHECKLIST-2.0&license=CHECKLIST-3.0" >merged.json
+  then
+    break
+  fi
+  sleep 1
+done
+kill $serverpid
+wait $serverpid
+if ! cmp examples/CHECKLIST-2.0+CHECKLIST-3.0.json merged.json
+then
+  exit 1
+fi
+rm -f merged.json server.log
+
+# Merge of all pairs of licenses
+./src/osloc2json.py --matrix 2 --jobs 2 examples/CHECKLIST-2.0.txt examples/CHECKLIST-3.0.txt examples/CHECKLIST-4.0.txt
+if test `wc -l <matrix.jsonl` != 3
+then
+  exit 1
+fi
+for i in CHECKLIST-2.0+CHECKLIST-3.0 CHECKLIST-2.0+CHECKLIST-4.0
+do
+  if ! python3 -c "import json, sys; sys.exit(json.load(open('examples/$i.json')) not in [json.loads(l) for l in open('matrix.jsonl')])"
+  then
+    exit 1
+  fi
+done
+rm -f matrix.jsonl
+
+# Compact and JSON Lines output
+./src/osloc2json.py examples/Apache-2.0.txt examples/GPL-3.0-or-later.txt
+./src/osloc2json.py --format compact -f osloc.json.gz examples/Apache-2.0.txt examples/GPL-3.0-or-later.txt
+./src/osloc2json.py --format jsonl -f osloc.jsonl examples/Apache-2.0.txt examples/GPL-3.0-or-later.txt
+if ! python3 -c "
+import gzip, json, sys
+osloc = json.load(open('osloc.json'))
+lines = [json.loads(l) for l in open('osloc.jsonl')]
+sys.exit(json.load(gzip.open('osloc.json.gz', 'rt')) != osloc or {k: v for l in lines for k, v in l.items()} != osloc['OSADL OSLOC'])
+"
+then
+  exit 1
+fi
+rm -f osloc.json osloc.json.gz osloc.jsonl
+
+# Parallel parsing
+./src/osloc2json.py -f osloc.json examples/*.txt
+./src/osloc2json.py --jobs 2 -f osloc-jobs.json examples/*.txt
+if ! cmp -s osloc.json osloc-jobs.json
+then
+  exit 1
+fi
+rm -f osloc.json osloc-jobs.json
+
+# Statistics
+./src/osloc2json.py -m -u --stats stats.json -f merged-stats.json examples/Apache-2.0.txt examples/GPL-3.0-or-later.txt
+if ! python3 -c "
+import json, sys
+stats = json.load(open('stats.json'))
+sys.exit(stats['licenses'] != ['Apache-2.0', 'GPL-3.0-or-later'] or 'merge' not in stats['phases'] or stats['functions']['addlrefs']['calls'] != 1)
+"
+then
+  exit 1
+fi
+./src/osloc2json.py -m --stats stats.json --statsmemory -f merged-stats.json examples/Apache-2.0.txt examples/GPL-3.0-or-later.txt
+if ! cmp examples/Apache-2.0+GPL-3.0-or-later.json merged-stats.json || ! python3 -c "
+import json, sys
+stats = json.load(open('stats.json'))
+sys.exit(stats['total']['peakmemory'] <= 0 or any('peakmemory' not in phase for phase in stats['phases'].values()))
+"
+then
+  exit 1
+fi
+rm -f stats.json merged-stats.json
+
+# Incremental build
+rm -rf buildtest
+cp -r examples buildtest
+rm -f buildtest/build.manifest.json
+./src/osloc2json.py --build --jobs 2 buildtest/build.json >/dev/null
+for i in `python3 -c "import json; print(' '.join(json.load(open('examples/build.json'))))"`
+do
+  if ! cmp examples/$i buildtest/$i
+  then
+    exit 1
+  fi
+done
+echo "COMPATIBILITY Foo" >>buildtest/MIT.txt
+./src/osloc2json.py -v --build buildtest/build.json >build.log
+if ! grep -q "Building 'FTL+MIT.json'" build.log || grep -q "Building 'CHECKLIST-2.0.json'" build.log
+then
+  cat build.log
+  exit 1
+fi
+if ! ./src/osloc2json.py --build buildtest/build.json | grep -q "^0 of"
+then
+  exit 1
+fi
+rm -rf buildtest build.log
+
+# Benchmark and synthetic licenses
+./src/benchmark.py --sizes 1,2 --repeat 1 --save benchmark.json >/dev/null
+./src/benchmark.py --generate synthetic --sizes 2 --depth 3
+./src/osloc2json.py -m -f synthetic.json synthetic/*.txt >synthetic.log
+if test -s synthetic.log
+then
+  cat synthetic.log
+  exit 1
+fi
+rm -rf benchmark.json synthetic synthetic.json synthetic.log
+
+# Optimization while parsing, without cache and with cold and warm parse cache, compared to optimization of parsed JSON
+mkdir opttest
+cp `ls examples/*.txt | grep -v '+'` opttest
+./src/benchmark.py --generate opttest --sizes 1,2 --depth 3 --eitherifs 2
+for i in opttest/*.txt
+do
+  j=`basename $i .txt`
+  ./src/osloc2json.py --no-cache opttest/$j.txt
+  ./src/osloc2json.py -o opttest/$j.json
+  mv opttest/$j-opt.json opttest/$j-reference.json
+  for k in --no-cache --cachedir=parsecache --cachedir=parsecache
+  do
+    ./src/osloc2json.py $k -o opttest/$j.txt
+    if ! cmp opttest/$j-opt.json opttest/$j-reference.json
+    then
+      diff -u opttest/$j-reference.json opttest/$j-opt.json
+      exit 1
+    fi
+  done
+done
+rm -rf opttest parsecache
 
 # OSADL filename split
 cd examples
@@ -363,7 +583,7 @@ then
   exit 1
 fi
 
-for i in `ls -1 examples/*.json | grep -v -e concatenated -e bogus`
+for i in `ls -1 examples/*.json | grep -v -e concatenated -e bogus -e build`
 do
   if echo $i | grep -q -e -v1
   then
@@ -396,6 +616,21 @@ then
 fi
 rm -f examples/jsonvalidity
 
+# Test parallel validation and validation of the output
+./src/osloc2json.py -jn -v examples/*.json >examples/jsonvalidity
+./src/osloc2json.py -jn -v --jobs 2 examples/*.json >examples/jsonvalidity-jobs
+if ! cmp -s examples/jsonvalidity examples/jsonvalidity-jobs
+then
+  echo Parallel JSON validity checker reported differently
+  exit 1
+fi
+if ./src/osloc2json.py --validateoutput -f osloc.json examples/FTL-bogus.json examples/MIT.txt >examples/jsonvalidity || ! grep -q "'OF'" examples/jsonvalidity
+then
+  echo Output validation erroneously assumed the incorrect license FTL valid
+  exit 1
+fi
+rm -f examples/jsonvalidity examples/jsonvalidity-jobs
+
 rm -f osloc.json merged.json *.checklist
 
 echo All tests passed
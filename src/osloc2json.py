@@ -7,9 +7,20 @@
 # Maintain Python 2.x compatibility
 # pylint: disable=consider-using-with,unspecified-encoding
 
+import base64
+import bisect
+import collections
+import contextvars
+import copy
+import hashlib
+import io
+import itertools
+import marshal
 import os
 import re
 import sys
+import time
+import weakref
 
 try:
     import argparse
@@ -24,21 +35,219 @@ try:
 except ImportError:
     pass
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class OSLOCError(Exception):
+    """ Error raised by the library functions of this module """
+
+class OSLOCSyntaxError(OSLOCError):
+    """ Syntax error in an OSLOC checklist, line is the offending line, if it is to be shown """
+    def __init__(self, message, licensename, lineno, line = None):
+        OSLOCError.__init__(self, message)
+        self.licensename = licensename
+        self.lineno = lineno
+        self.line = line
+
+currentstats = contextvars.ContextVar('currentstats', default = None)
+
+class Stats:
+    """ Statistics of a conversion: wall and CPU time and optionally peak memory of the phases, and the number of calls
+        of and nodes visited by the recursive functions
+
+        While a Stats object is in use as context manager, it is the current statistics of its context, e.g. of its
+        thread, and the phases and the calls of the counted functions in this context are recorded.
+        Times are inclusive of nested phases. Tracing memory with tracemalloc slows the conversion down considerably,
+        and tracemalloc traces all threads. The counted functions count themselves with count(). """
+
+    counted = ['clonejson', 'mergelicenses', 'mergedicts', 'addlrefs', 'expandor', 'optjson', 'uniq',
+      'UnifyRules.unifyobligations']
+
+    def __init__(self, memory = False, hook = None):
+        self.memory = memory
+        self.hook = hook
+        self.phases = {}
+        self.functions = {name: {'calls': 0, 'nodes': 0} for name in Stats.counted}
+        self.licenses = []
+        self.stack = []
+        self.token = None
+        self.start = None
+        self.total = None
+        self.memoryoffset = 0
+
+    def __enter__(self):
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start()
+        self.start = (time.perf_counter(), time.process_time())
+        self.token = currentstats.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        currentstats.reset(self.token)
+        self.token = None
+        self.total = {'wall': time.perf_counter() - self.start[0], 'cpu': time.process_time() - self.start[1]}
+        if self.memory:
+            import tracemalloc
+            self.total['peakmemory'] = self.tracedmemory()[1]
+            tracemalloc.stop()
+        if self.hook is not None:
+            self.hook(self.report())
+        return False
+
+    def count(self, name):
+        """ Count a node visited by the calling function, and a call of it, if it is not called by itself, directly or
+            through other functions """
+        counts = self.functions[name]
+        counts['nodes'] += 1
+        frame = sys._getframe(1)
+        code = frame.f_code
+        frame = frame.f_back
+        while frame is not None and frame.f_code is not code:
+            frame = frame.f_back
+        if frame is None:
+            counts['calls'] += 1
+
+    def enter(self, name):
+        """ Start timing a phase """
+        entry = {'name': name, 'wall': time.perf_counter(), 'cpu': time.process_time()}
+        if self.memory:
+            current, peak = self.tracedmemory()
+            if len(self.stack) > 0:
+                # The peak of the enclosing phase so far is lost when the peak is reset
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            self.resetpeak()
+            current = self.tracedmemory()[0]
+            entry['current'] = current
+            entry['peak'] = current
+        self.stack.append(entry)
+
+    def leave(self):
+        """ Stop timing the current phase and add its times to the statistics """
+        entry = self.stack.pop()
+        phase = self.phases.setdefault(entry['name'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+        phase['calls'] += 1
+        phase['wall'] += time.perf_counter() - entry['wall']
+        phase['cpu'] += time.process_time() - entry['cpu']
+        if self.memory:
+            peak = max(entry['peak'], self.tracedmemory()[1])
+            phase['peakmemory'] = max(phase.get('peakmemory', 0), peak - entry['current'])
+            if len(self.stack) > 0:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+
+    def tracedmemory(self):
+        """ Return the current and the peak size of the memory traced since the start of the statistics """
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        return current + self.memoryoffset, peak + self.memoryoffset
+
+    def resetpeak(self):
+        """ Reset the peak of the traced memory to its current size
+
+            Before Python 3.9, tracemalloc has no reset_peak(), and tracing is restarted instead. The memory traced
+            so far is kept as offset, so that the sizes stay comparable, but the blocks allocated before the restart are
+            no longer subtracted when they are freed, which may overstate the peaks of later phases. """
+        import tracemalloc
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            self.memoryoffset += tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            tracemalloc.start()
+
+    def report(self):
+        """ Return the statistics as JSON object """
+        return {'licenses': self.licenses, 'total': self.total, 'phases': self.phases, 'functions': self.functions}
+
+    def save(self, filename):
+        """ Write the statistics to a file in JSON format """
+        statsfile = open(filename, 'w')
+        json.dump(self.report(), statsfile, indent = 4, sort_keys = True)
+        statsfile.write('\n')
+        statsfile.close()
+
+class Phase:
+    """ Context manager that times a phase, if statistics are collected """
+    def __init__(self, name):
+        self.name = name
+        self.stats = None
+
+    def __enter__(self):
+        self.stats = currentstats.get()
+        if self.stats is not None:
+            self.stats.enter(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.stats is not None:
+            self.stats.leave()
+        return False
+
 def sanitizelist(l):
     """ Remove duplicates, sort case-unsensitive alphabetically, remove singular form, if plural of same term exists """
-    sane = sortlist(list(dict.fromkeys(l)))
-    return mkpluralonlylist(sane)
+    return ObligationList(dict.fromkeys(l))
 
 def mkpluralonlylist(l):
     """ Remove singular form of list element, if plural of same term exists """
-    for e in l.copy():
-        if not e.endswith('s') and e + 's' in l:
-            l.remove(e)
+    terms = set(l)
+    l[:] = [e for e in l if e.endswith('s') or e + 's' not in terms]
     return l
 
 def sortlist(l):
     """ Sort list case-unsensitive alphabetically """
-    return mkpluralonlylist(sorted(l, key = lambda s: s.lower()))
+    return ObligationList(l)
+
+class ObligationList(list):
+    """ A list of obligations kept sorted case-unsensitive alphabetically without singular forms of plural terms
+
+        The lowercase sort keys and the number of occurrences of every element are kept along with the list, so that
+        add() finds the position of a new element by bisection and checks for duplicates and for singular and plural
+        forms without scanning the list. Elements with the same sort key stay in the order they were added in. The
+        list must only be changed with add() and update(), changing it with the methods of list leaves the sort keys
+        and counts behind. """
+
+    def __init__(self, l = ()):
+        l = mkpluralonlylist(sorted(l, key = lambda s: s.lower()))
+        list.__init__(self, l)
+        self.sortkeys = [e.lower() for e in l]
+        self.counts = {}
+        for e in l:
+            self.counts[e] = self.counts.get(e, 0) + 1
+
+    def __reduce__(self):
+        return (ObligationList, (list(self), ))
+
+    def add(self, e):
+        """ Insert an element at its sorted position, unless it or its plural form is present already, remove its
+            singular form, return whether the list was changed """
+        if e in self.counts or (not e.endswith('s') and e + 's' in self.counts):
+            return False
+        sortkey = e.lower()
+        i = bisect.bisect_right(self.sortkeys, sortkey)
+        self.insert(i, e)
+        self.sortkeys.insert(i, sortkey)
+        self.counts[e] = 1
+        singular = e[:-1]
+        if e.endswith('s') and not singular.endswith('s') and singular in self.counts:
+            sortkey = singular.lower()
+            i = bisect.bisect_left(self.sortkeys, sortkey)
+            while i < len(self) and self.sortkeys[i] == sortkey:
+                if self[i] == singular:
+                    del self[i]
+                    del self.sortkeys[i]
+                else:
+                    i += 1
+            self.counts.pop(singular)
+        return True
+
+    def update(self, l):
+        """ Add all elements of a list, return whether the list was changed """
+        changed = False
+        for e in l:
+            if self.add(e):
+                changed = True
+        return changed
 
 def sortdict(d):
     """ Sort dict alphabetically by key """
@@ -60,6 +269,9 @@ def mkpluralonlydict(d):
 
 def expandor(d, parent):
     """ Split a dict item with two OR-ed conditions into two separate items with the same value """
+    runstats = currentstats.get()
+    if runstats is not None:
+        runstats.count('expandor')
     if isinstance(d, dict):
         for k, v in d.copy().items():
             if isinstance(v, dict):
@@ -174,30 +386,43 @@ def flatten(v, prefix=''):
         result.append(p2)
     return result
 
-def deepcopy(target, source, parent = {}, tag = ''):
-    if isinstance(source, dict):
-        for k, v in source.copy().items():
-            target[k] = {}
-            deepcopy(target[k], v, target, k)
-    elif isinstance(source, list):
-        parent[tag] = []
-        for i, v in enumerate(source.copy()):
-            parent[tag].append(v)
-    elif isinstance(source, str):
-        parent[tag] = source
-
-formlang = []
-def addlrefs(v, lrefs, parent = {}, tag = '', prefix = ''):
-    global formlang
-
-    if formlang == []:
-        lang = ['USE CASE', 'YOU MUST', 'YOU MUST NOT', 'ATTRIBUTE', 'IF', 'ELSE', 'EITHER', 'OR', 'EXCEPT IF', 'EITHER IF', 'OR IF']
-        for l in lang:
-            formlang.append("['{}']".format(l))
+formlang = tuple("['{}']".format(l) for l in ['USE CASE', 'YOU MUST', 'YOU MUST NOT', 'ATTRIBUTE', 'IF', 'ELSE', 'EITHER', 'OR', 'EXCEPT IF', 'EITHER IF', 'OR IF'])
+refnumberpattern = re.compile(r"\['([0-9]*|\*)'\]$")
+
+def mklrefsindex(lrefs):
+    """ Return the license references sorted by path together with their original position, so that all
+        references to a subtree are found by bisection """
+    return sorted((lref, i, licenses) for i, (lref, licenses) in enumerate(lrefs.items()))
+
+def mklicenserefs(new, allrefs):
+    """ Return the paths of the merged license new that the licenses in allrefs refer to, each with the names of these licenses """
+    licenserefs = {}
+    allflat = sorted(flatten(new.copy()))
+    for license, refs in allrefs.items():
+        for ref in flatten(refs):
+            # All paths that start with ref follow ref in sorted order
+            i = bisect.bisect_left(allflat, ref)
+            if i < len(allflat) and allflat[i].startswith(ref):
+                if ref not in licenserefs:
+                    licenserefs[ref] = []
+                if license not in licenserefs[ref]:
+                    licenserefs[ref].append(license)
+    return licenserefs
+
+def addlrefs(v, lrefs, tag = '', prefix = '', lrefsindex = None):
+    """ Recursively return a copy of v with the names of the licenses that refer to a key or a value appended to the key or the value
+
+        Keys with license names appended follow the other keys of their dict in the copy. """
+    runstats = currentstats.get()
+    if runstats is not None:
+        runstats.count('addlrefs')
+    if lrefsindex is None:
+        lrefsindex = mklrefsindex(lrefs)
 
-    result = []
     if isinstance(v, dict):
-        for k, v2 in v.copy().items():
+        new = {}
+        renamed = []
+        for k, v2 in v.items():
             if k.isdigit() and (prefix.endswith("['EITHER']") or prefix.endswith("['EITHER IF']")):
                 wildk = '*'
             else:
@@ -208,206 +433,367 @@ def addlrefs(v, lrefs, parent = {}, tag = '', prefix = ''):
                 for lic in lrefs[p2]:
                     if lic not in found:
                         found.append(lic)
-            islang = False
-            for l in formlang:
-                if p2.endswith(l):
-                    islang = True
-                    break
-            if not islang:
-                if tag != '' and not re.search(r"\['([0-9]*|\*)'\]$", p2):
-                    for lref,license in lrefs.items():
-                        if lref.startswith(p2):
-                            for lic in license:
-                                if lic not in found:
-                                    found.append(lic)
-            newk = k + ' | '
+            if not p2.endswith(formlang) and tag != '' and not refnumberpattern.search(p2):
+                i = bisect.bisect_left(lrefsindex, (p2,))
+                subtreerefs = []
+                while i < len(lrefsindex) and lrefsindex[i][0].startswith(p2):
+                    subtreerefs.append(lrefsindex[i][1:])
+                    i += 1
+                for position, licenses in sorted(subtreerefs):
+                    for lic in licenses:
+                        if lic not in found:
+                            found.append(lic)
             if found != []:
                 found = sorted(found, key = lambda s: s.lower())
-            for l in found:
-                old = v[k]
-                parent[tag].pop(k)
-                if newk.endswith(' | '):
-                    newk += l
-                else:
-                    newk += ', ' + l
-                parent[tag][newk] = old
-                k = newk
+                k = k + ' | ' + ', '.join(found)
             if v2 == {}:
-                result.append(p2)
+                v2 = {}
             else:
-                result.extend(addlrefs(v2, lrefs, v, k, prefix = p2))
-    elif isinstance(v, list):
-        for i, v2 in enumerate(v):
-            #p2 = "{}['{}']".format(prefix, i)
-            #result.extend(addlrefs(v2, lrefs, v, i, prefix = p2))
-            result.extend(addlrefs(v2, lrefs, v, i, prefix))
-    elif isinstance(v, str):
+                v2 = addlrefs(v2, lrefs, k, p2, lrefsindex)
+            if found != []:
+                renamed.append((k, v2))
+            else:
+                new[k] = v2
+        for k, v2 in renamed:
+            new[k] = v2
+        return new
+    if isinstance(v, list):
+        return [addlrefs(v2, lrefs, i, prefix, lrefsindex) for i, v2 in enumerate(v)]
+    if isinstance(v, str):
         p2 = "{}['{}']".format(prefix, v)
         if p2 in lrefs:
-            newv = parent[tag] + ' | '
-            for l in lrefs[p2]:
-                if newv.endswith(' | '):
-                    newv += l
-                else:
-                    newv += ', ' + l
-            parent[tag] = newv
-        result.append(p2)
-    return result
+            return v + ' | ' + ', '.join(lrefs[p2])
+    return v
+
+def clonejson(v):
+    """ Return a deep copy of JSON data made of dicts, lists and strings """
+    runstats = currentstats.get()
+    if runstats is not None:
+        runstats.count('clonejson')
+    if isinstance(v, dict):
+        return {k: clonejson(v2) for k, v2 in v.items()}
+    if isinstance(v, list):
+        return [clonejson(v2) for v2 in v]
+    return v
 
-def extend(l1, l2, devel, chain1, chain2, unify):
-    """ Recursively add a dict to another dict while removing duplicates and extending items with the same key """
-    if l1 == l2:
-        return l1
-    new = {}
-    deepcopy(new, l1)
-    newl2 = {}
-    deepcopy(newl2, l2)
-    l2 = newl2
-
-    for k1, v1 in l1.items():
-        chain1.append(k1)
-        for k2, v2 in l2.items():
-            chain2.append(k2)
-            if chain1 == chain2 and v1 == v2:
-                chain2.pop()
-                continue
-            if isinstance(v2, str):
-                if k2 not in new:
-                    new[k2] = v2
-                else:
-                    if isinstance(new[k2], str):
-                        if new[k2] != v2:
-                            new[k2] = [new[k2], v2]
-                    elif isinstance(new[k2], list):
-                        if v2 not in new[k2]:
-                            new[k2].append(v2)
-                            new[k2] = sortlist(new[k2])
-                    elif isinstance(new[k2], dict):
-                        if v2 not in new[k2]:
-                            new[k2][v2] = {}
-
-            elif isinstance(v2, list):
-                if k2 not in new:
-                    new[k2] = v2
-                else:
-                    if isinstance(new[k2], str):
-                        if new[k2] not in v2:
-                            v2.append(new[k2])
-                            new[k2] = v2.copy()
-                    elif isinstance(new[k2], list):
-                        if not listinlist(v2, new[k2]):
-                            for v in v2:
-                                if v not in new[k2]:
-                                    new[k2].append(v)
-                            new[k2] = sortlist(new[k2])
-                    elif isinstance(new[k2], dict):
-                        new[k2] = list2dict(v2, new[k2])
-
-            elif isinstance(v2, dict):
-                if k2 not in new:
-                    new[k2] = v2
-                else:
-                    if isinstance(new[k2], str):
-                        if new[k2] not in v2:
-                            v2[new[k2]] = {}
-                            new[k2] = v2.copy()
-                    elif isinstance(new[k2], list):
-                        new[k2] = list2dict(new[k2], v2)
-                    elif isinstance(new[k2], dict):
-                        if not dictlistindictlist(v2, new[k2]):
-                            if new[k2] == {} and v2 != {}:
-                                new[k2] = v2
-                            else:
-                                new[k2] = extend(new[k2], v2, devel, chain2.copy(), chain2, unify)
+class CompactNode:
+    """ A dict or list of a license tree encoded by a Vocabulary
+
+        keys is the tuple of the term IDs of the keys of a dict or None for a list, values is the tuple of the
+        encoded values, i.e. term IDs of strings and other nodes. """
+
+    __slots__ = ('keys', 'values', '__weakref__')
+
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+
+class Vocabulary:
+    """ Terms and subtrees shared by license trees that are held in memory in encoded form
+
+        Encoding a tree replaces its keys and strings by the IDs of interned terms and its dicts and lists by
+        immutable CompactNode objects; equal subtrees are encoded only once and shared by all trees that contain
+        them, as long as any of them is alive. Decoding returns new JSON data of the original shape. """
+
+    def __init__(self):
+        self.terms = []
+        self.ids = {}
+        self.nodes = weakref.WeakValueDictionary()
+
+    def __getstate__(self):
+        return {'terms': self.terms}
+
+    def __setstate__(self, state):
+        self.__init__()
+        for term in state['terms']:
+            self.termid(term)
+
+    def termid(self, term):
+        """ Return the ID of a term, add it to the vocabulary if it is new """
+        if isinstance(term, str):
+            key = term
+        else:
+            key = (type(term), term)
+        i = self.ids.get(key)
+        if i is None:
+            i = len(self.terms)
+            self.ids[key] = i
+            self.terms.append(term)
+        return i
+
+    def encode(self, v):
+        """ Return the encoded form of JSON data """
+        ids = self.ids
+        nodes = self.nodes
+        termid = self.termid
+
+        def encodenode(keys, items):
+            values = tuple([ids[v2] if v2.__class__ is str and v2 in ids else encodevalue(v2) for v2 in items])
+            content = (keys, values)
+            node = nodes.get(content)
+            if node is None:
+                node = CompactNode(keys, values)
+                nodes[content] = node
+            return node
+
+        def encodevalue(v):
+            if isinstance(v, dict):
+                return encodenode(tuple([ids[k] if k in ids else termid(k) for k in v]), v.values())
+            if isinstance(v, list):
+                return encodenode(None, v)
+            return termid(v)
+
+        return encodevalue(v)
+
+    def decode(self, v):
+        """ Return new JSON data from its encoded form """
+        terms = self.terms
+
+        def decodenode(node):
+            if node.keys is None:
+                return [terms[v2] if v2.__class__ is int else decodenode(v2) for v2 in node.values]
+            return {terms[k]: terms[v2] if v2.__class__ is int else decodenode(v2) for k, v2 in zip(node.keys, node.values)}
+
+        if v.__class__ is int:
+            return terms[v]
+        return decodenode(v)
+
+def mergeitems(new, l2, unify, l2changes, mergedict):
+    """ Merge all items of l2 into new in a single pass while removing duplicates and extending items with the same key,
+        new is modified in place
+
+        l2 is not modified, values of l2 that are extended by a value of new are stored in l2changes instead, so that
+        a further pass sees them. Dicts found in both are merged with mergedict(). """
+    for k2, v2 in l2.items():
+        if k2 in l2changes:
+            v2 = l2changes[k2]
+        if k2 not in new:
+            new[k2] = clonejson(v2)
+            continue
+        v1 = new[k2]
+        if isinstance(v2, str):
+            if isinstance(v1, str):
+                if v1 != v2:
+                    new[k2] = [v1, v2]
+            elif isinstance(v1, list):
+                if not isinstance(v1, ObligationList):
+                    if v2 in v1:
+                        continue
+                    v1 = new[k2] = ObligationList(v1)
+                v1.add(v2)
+            elif isinstance(v1, dict):
+                if v2 not in v1:
+                    v1[v2] = {}
+
+        elif isinstance(v2, list):
+            if isinstance(v1, str):
+                if v1 not in v2:
+                    l2changes[k2] = v2 + [v1]
+                    new[k2] = clonejson(l2changes[k2])
+            elif isinstance(v1, list):
+                if not isinstance(v1, ObligationList):
+                    if listinlist(v2, v1):
+                        continue
+                    v1 = new[k2] = ObligationList(v1)
+                v1.update(v2)
+            elif isinstance(v1, dict):
+                new[k2] = list2dict(v2, v1)
+
+        elif isinstance(v2, dict):
+            if isinstance(v1, str):
+                if v1 not in v2:
+                    l2changes[k2] = v2.copy()
+                    l2changes[k2][v1] = {}
+                    new[k2] = clonejson(l2changes[k2])
+            elif isinstance(v1, list):
+                new[k2] = list2dict(v1, clonejson(v2))
+            elif isinstance(v1, dict):
+                if not dictlistindictlist(v2, v1):
+                    if v1 == {} and v2 != {}:
+                        new[k2] = clonejson(v2)
+                    else:
+                        new[k2] = mergedict(v1, v2, unify)
+
+def mergedicts(new, l2, unify):
+    """ Recursively merge the dict l2 into the dict new in place, return the merged dict
+
+        The result is that of a merge that runs its loop over the items of l2 once per key of new. All passes
+        after the second one do not change anything, and the second one only repeats the merge of the nested
+        dicts that are already merged, which remergedicts() does without repeating itself again. l2 is not
+        modified and does not share any data with the result. """
+    runstats = currentstats.get()
+    if runstats is not None:
+        runstats.count('mergedicts')
+    if new == l2:
+        return new
+    passes = len(new)
+    l2changes = {}
+    if passes > 0:
+        mergeitems(new, l2, unify, l2changes, mergedicts)
+    if passes > 1:
+        mergeitems(new, l2, unify, l2changes, remergedicts)
+    if not unify:
+        new = mkpluralonlydict(new)
+    return new
+
+def remergedicts(new, l2, unify):
+    """ Merge the dict l2 into the dict new again, if new already is the result of merging l2 into a dict """
+    if new == l2:
+        return new
+    mergeitems(new, l2, unify, {}, remergedicts)
+    if not unify:
+        new = mkpluralonlydict(new)
+    return new
 
-            chain2.pop()
-        chain1.pop()
-    if isinstance(new, dict):
-        if not unify:
-            new = mkpluralonlydict(new)
+def mergelicenses(licenses, unify, mergecache = None):
+    """ Merge a list of licenses into a copy of the first license one after another, without copying the intermediate
+        results, and return the copy
+
+        If a merge cache is given, start from the result of the longest sequence of first licenses found in
+        the cache and store the results of all further licenses. """
+    runstats = currentstats.get()
+    if runstats is not None:
+        runstats.count('mergelicenses')
+    new = licenses[0]
+    owned = False
+    start = 1
+    if mergecache is not None:
+        keys = []
+        key = ''
+        for licensedata in licenses:
+            key = mergecache.key(key, licensedata, unify)
+            keys.append(key)
+        for i in range(len(licenses) - 1, 0, -1):
+            cached = mergecache.get(keys[i])
+            if cached is not None:
+                new = cached
+                owned = True
+                start = i + 1
+                break
+    for i in range(start, len(licenses)):
+        l2 = licenses[i]
+        if new == l2:
+            continue
+        if not owned:
+            new = clonejson(new)
+            owned = True
+        new = mergedicts(new, l2, unify)
+        if mergecache is not None:
+            mergecache.put(keys[i], new)
+    if not owned:
+        new = clonejson(new)
     return new
 
+nondigitpattern = re.compile('[^0-9]')
+
+def optvalue(v):
+    """ Return a value of a dict in the form optjson() converts it to, provided that its own values are converted already """
+    if isinstance(v, dict):
+        for v2 in v.values():
+            if v2 is not None and len(v2) > 0:
+                break
+        else:
+            v = list(v.keys())
+        for k in v:
+            if len(k) == 0 and len(v) == 1:
+                v = v[k]
+            break
+        dictno = 0
+        for k in v:
+            if len(k) == 0 or nondigitpattern.search(k) or int(k) != dictno:
+                break
+            dictno = dictno + 1
+        if dictno == len(v):
+            newlist = []
+            for k in v:
+                newlist.append(v[k])
+            v = newlist
+    if isinstance(v, list):
+        if len(v) == 1:
+            v = v[0]
+        else:
+            v = sorted(v, key = str.lower)
+    return v
+
 def optjson(l):
     """ 1. If a dict has only keys, but no values, convert it to a list of keys
         2. If a dict has a list with a single element, propagate it to the parent dict
         3. If a dict has a dict with a single element with an empty key, propagate the dict to the parent dict
         4. If a dict has only dicts with consecutively numbered numeric keys, propagate the dicts into a list """
+    runstats = currentstats.get()
+    if runstats is not None:
+        runstats.count('optjson')
     if isinstance(l, dict):
         for e in l:
             if l[e]:
                 optjson(l[e])
-                if isinstance(l[e], dict):
-                    allvalues = 0
-                    for v in l[e].values():
-                        if v is not None:
-                            allvalues += len(v)
-                    if allvalues == 0:
-                        l[e] = list(l[e].keys())
-                    dictno = 0
-                    for k in l[e]:
-                        if len(k) == 0 and len(l[e]) == 1:
-                            l[e] = l[e][k]
-                        break
-                    for k in l[e]:
-                        if len(k) != 0 and not re.search('[^0-9]', k):
-                            if int(k) != dictno:
-                                break
-                            dictno = dictno + 1
-                    if dictno == len(l[e]):
-                        newlist = []
-                        for k in l[e]:
-                            newlist.append(l[e][k])
-                        l[e] = newlist
-                if isinstance(l[e], list):
-                    if len(l[e]) == 1:
-                        l[e] = l[e][0]
-                    else:
-                        l[e] = sorted(l[e], key = lambda s: s.lower())
+                l[e] = optvalue(l[e])
+
+def optlicenses(jsondata, parsedoptimized):
+    """ Optimize licenses given as dict of license names and JSON objects as optjson() does, but only convert the
+        licenses found in parsedoptimized themselves, since their values were converted while they were parsed """
+    for licensename in jsondata:
+        if jsondata[licensename]:
+            if licensename not in parsedoptimized:
+                optjson(jsondata[licensename])
+            jsondata[licensename] = optvalue(jsondata[licensename])
 
 def uniq(l):
+    """ Recursively remove the dicts with numbered keys from a dict that are equal to a dict with a lower number
+
+        Only dicts with the same keys can be equal, so the dicts are bucketed by their keys and compared only within a
+        bucket instead of pairwise. """
+    runstats = currentstats.get()
+    if runstats is not None:
+        runstats.count('uniq')
     if isinstance(l, dict):
-        for k1, v1 in l.copy().items():
-            for k2, v2 in l.copy().items():
-                if k1 == k2:
-                    continue
-                if k1 not in l or not isinstance(l[k1], dict) or k2 not in l or not isinstance(l[k2], dict):
-                    continue
-                if not k1.isdigit() or not k2.isdigit():
-                    continue
-                if v1 == v2:
-                    if int(k1) > int(k2):
-                        l.pop(k1)
-                    else:
-                        l.pop(k2)
+        candidates = [k for k, v in l.items() if isinstance(v, dict) and k.isdigit()]
+        if len(candidates) > 1:
+            buckets = {}
+            for k in candidates:
+                buckets.setdefault(frozenset(l[k]), []).append(k)
+            duplicates = []
+            for keys in buckets.values():
+                while len(keys) > 1:
+                    equal = []
+                    unequal = []
+                    for k in keys:
+                        if l[k] == l[keys[0]]:
+                            equal.append(k)
+                        else:
+                            unequal.append(k)
+                    if len(equal) > 1:
+                        kept = min(equal, key = int)
+                        duplicates += [k for k in equal if k != kept]
+                    keys = unequal
+            for k in duplicates:
+                l.pop(k)
         for k in l:
-            if isinstance(l[k], dict):
+            if isinstance(l[k], dict) and len(l[k]) > 0:
                 uniq(l[k])
 
-printnonl = sys.stdout.write
-def back2osloc(l, indent, key, ineitheror, ineitheriforif, previous, eitheriforifenum, extraindent, version):
+def prunelevels(levels, indent):
+    """ Remove the entries of the indentation levels deeper than indent """
+    if len(levels) > 0:
+        for k in [k for k in levels if k > indent]:
+            levels.pop(k)
+
+def back2osloc(l, indent, key, ineitheror, ineitheriforif, previous, eitheriforifenum, extraindent, version, outfile = None):
+    """ Recursively write a JSON object as OSLOC checklist to outfile, default standard output """
+    if outfile is None:
+        outfile = sys.stdout
     if isinstance(l, dict):
         count = 0
         if previous in ['', 'ATTRIBUTE', 'EXCEPT IF', 'IF', 'YOU MUST', 'YOU MUST NOT']:
             l = sortdict(l)
+        keys = list(l)
         if 'OR' in l:
-            newl = {}
-            for e in l:
-                if e != 'OR':
-                    newl[e] = l[e]
-            for e in l:
-                if e == 'OR':
-                    newl[e] = l[e]
-            l = newl
+            keys.remove('OR')
+            keys.append('OR')
         if version > 1 and 'OR IF' in l:
-            newl = {}
-            for e in l:
-                if e != 'OR IF':
-                    newl[e] = l[e]
-            for e in l:
-                if e == 'OR IF':
-                    newl[e] = l[e]
-            l = newl
-        for e in l:
+            keys.remove('OR IF')
+            keys.append('OR IF')
+        for e in keys:
             if indent == 0 and e in ['COMPATIBILITY', 'COPYLEFT CLAUSE', 'DEPENDING COMPATIBILITY', 'INCOMPATIBILITY', 'INCOMPATIBLE LICENSES', 'PATENT HINTS']:
                 if e in ['COPYLEFT CLAUSE', 'PATENT HINTS']:
                     if (isinstance(l[e], list) and len(l[e]) == 1 and l[e][0] == 'No') or (isinstance(l[e], str) and l[e] == 'No'):
@@ -415,42 +801,36 @@ def back2osloc(l, indent, key, ineitheror, ineitheriforif, previous, eitherifori
                 if isinstance(l[e], list):
                     for v in l[e]:
                         if previous != '':
-                            print()
-                        printnonl(e + ' ' + v)
+                            outfile.write('\n')
+                        outfile.write(e + ' ' + v)
                         previous = e
                 else:
                     if previous != '':
-                        print()
-                    printnonl(e + ' ' + l[e])
+                        outfile.write('\n')
+                    outfile.write(e + ' ' + l[e])
                     previous = e
                 continue
             if indent == 0 and e == 'COPYLEFT LICENSES':
                 continue
             if version > 1:
-                for k in ineitheriforif.copy():
-                    if k > indent:
-                        ineitheriforif.pop(k)
-                for k in eitheriforifenum.copy():
-                    if k > indent:
-                        eitheriforifenum.pop(k)
+                prunelevels(ineitheriforif, indent)
+                prunelevels(eitheriforifenum, indent)
                 if e == 'OR IF':
                     extraindent += 1
-            for k in ineitheror.copy():
-                if k > indent:
-                    ineitheror.pop(k)
+            prunelevels(ineitheror, indent)
             if e == 'OR':
                 indent -= 1
             if len(ineitheror) > 0 and not e.isdigit() and indent > 0:
                 if indent in ineitheror:
-                    if previous != '1' and e == list(l.keys())[0]:
-                        print()
-                        printnonl('\t'*(indent - 1 - extraindent) + ineitheror[indent])
+                    if previous != '1' and e == keys[0]:
+                        outfile.write('\n')
+                        outfile.write('\t'*(indent - 1 - extraindent) + ineitheror[indent])
             if version > 1:
                 if len(ineitheriforif) > 0 and not e.isdigit() and indent > 0:
                     if indent in ineitheriforif:
                         if indent in eitheriforifenum and eitheriforifenum[indent] != '1' and previous.isdigit():
-                            print()
-                            printnonl('\t'*(indent - 1 - extraindent) + ineitheriforif[indent] + ' ')
+                            outfile.write('\n')
+                            outfile.write('\t'*(indent - 1 - extraindent) + ineitheriforif[indent] + ' ')
 
             if e.isdigit():
                 increment = 0
@@ -465,85 +845,202 @@ def back2osloc(l, indent, key, ineitheror, ineitheriforif, previous, eitherifori
             else:
                 if not re.search('[a-z]', e):
                     if previous != '':
-                        print()
+                        outfile.write('\n')
                     if e not in ['EITHER', 'OR']:
                         appendchar = ' '
                     else:
                         appendchar = ''
                     if indent == 0:
-                        printnonl(e + appendchar)
+                        outfile.write(e + appendchar)
                     else:
-                        printnonl('\t'*(indent - extraindent) + e + appendchar)
+                        outfile.write('\t'*(indent - extraindent) + e + appendchar)
                     increment = 1
                 else:
                     if count == 0:
-                        printnonl(e)
+                        outfile.write(e)
                     else:
                         if indent == 0:
-                            printnonl(key + ' ' + e)
+                            outfile.write(key + ' ' + e)
                         else:
                             if count == 0:
-                                printnonl('\t'*(indent - extraindent) + key + ' ' + e)
+                                outfile.write('\t'*(indent - extraindent) + key + ' ' + e)
                             else:
-                                print()
+                                outfile.write('\n')
                                 if indent - 1 == 0:
-                                    printnonl(key + ' ' + e)
+                                    outfile.write(key + ' ' + e)
                                 else:
-                                    printnonl('\t'*(indent - 1 - extraindent) + key + ' ' + e)
+                                    outfile.write('\t'*(indent - 1 - extraindent) + key + ' ' + e)
                     increment = 0
-            back2osloc(l[e], indent + increment, e, ineitheror, ineitheriforif, e, eitheriforifenum, extraindent, version)
+            back2osloc(l[e], indent + increment, e, ineitheror, ineitheriforif, e, eitheriforifenum, extraindent, version, outfile)
             if e == 'OR':
                 indent += 1
             count += 1
     elif isinstance(l, list):
         count = 0
-        for e in l.copy():
+        for e in l:
             if isinstance(e, dict):
-                back2osloc(e, indent, key, ineitheror, ineitheriforif, '', eitheriforifenum, extraindent, version)
+                back2osloc(e, indent, key, ineitheror, ineitheriforif, '', eitheriforifenum, extraindent, version, outfile)
             else:
                 if count == 0:
-                    printnonl(e)
+                    outfile.write(e)
                 else:
-                    print()
-                    printnonl('\t'*(indent - 1 - extraindent) + key + ' ' + e)
+                    outfile.write('\n')
+                    outfile.write('\t'*(indent - 1 - extraindent) + key + ' ' + e)
                 count += 1
     elif isinstance(l, str):
-        printnonl(l)
-
-def unifyobligations(d, tag, replacelist):
-    """ Unify obligations according to semantic rules """
-    for k, v in d.items():
-        tagrefs = ''
-        if isinstance(v, dict) and k in ['YOU MUST', 'YOU MUST NOT', 'ATTRIBUTE']:
+        outfile.write(l)
+
+class UnifyRules:
+    """ Unify rules compiled into an index of the obligations they refer to
+
+        Rules are applied in the order of the rules file, but in a single walk through the license: every list of
+        obligations only looks up the rules its obligations are target or unifyable of, and the rules that do not
+        apply to it are passed down to the levels below together. """
+
+    obligationkeys = ('YOU MUST', 'YOU MUST NOT', 'ATTRIBUTE')
+
+    def __init__(self, rules):
+        if isinstance(rules, UnifyRules):
+            rules = rules.rules
+        if not isinstance(rules, dict):
+            raise OSLOCError('Unify rules must be a dict of obligations and lists of unifyable obligations')
+        self.rules = {}
+        self.tags = []
+        self.replacelists = []
+        self.bytag = {}
+        self.byunifyable = {}
+        for tag, replacelist in rules.items():
+            if not isinstance(replacelist, list) or not all(isinstance(unifyable, str) for unifyable in replacelist):
+                raise OSLOCError('Unify rule %r must map to a list of obligations' % tag)
+            if tag in replacelist:
+                raise OSLOCError('Unify rule %r unifies the obligation with itself' % tag)
+            if len(set(replacelist)) != len(replacelist):
+                duplicate = [unifyable for unifyable in replacelist if replacelist.count(unifyable) > 1][0]
+                raise OSLOCError('Unify rule %r lists %r more than once' % (tag, duplicate))
+            i = len(self.tags)
+            self.rules[tag] = list(replacelist)
+            self.tags.append(tag)
+            self.replacelists.append(tuple(replacelist))
+            self.bytag[tag] = i
+            for unifyable in replacelist:
+                self.byunifyable.setdefault(unifyable, []).append(i)
+        self.checkcycles()
+        self.all = tuple(range(len(self.tags)))
+
+    def checkcycles(self):
+        """ Raise OSLOCError if an obligation is directly or indirectly unified with itself """
+        visited = set()
+        for start in self.tags:
+            if start in visited:
+                continue
+            path = [start]
+            stack = [iter(self.rules[start])]
+            while len(stack) > 0:
+                unifyable = next(stack[-1], None)
+                if unifyable is None:
+                    visited.add(path.pop())
+                    stack.pop()
+                elif unifyable in path:
+                    cycle = path[path.index(unifyable):] + [unifyable]
+                    raise OSLOCError('Unify rules are cyclic: %s' % ' -> '.join(cycle))
+                elif unifyable in self.rules and unifyable not in visited:
+                    path.append(unifyable)
+                    stack.append(iter(self.rules[unifyable]))
+
+    def apply(self, d):
+        """ Unify obligations of a license or of a license tree in place """
+        self.unifyitems(d, self.all)
+
+    def unifyitems(self, d, pending):
+        """ Apply the pending rules to all obligations below d """
+        for k, v in d.items():
+            if isinstance(v, dict) and k in self.obligationkeys:
+                self.unifyobligations(v, pending)
+            elif isinstance(v, list) and k in self.obligationkeys:
+                self.unifylist(d, k, pending)
+            elif isinstance(v, dict):
+                self.unifyitems(v, pending)
+
+    def candidates(self, obligations, pending):
+        """ Return the pending rules with one of the obligations as target in the order of the rules, and the
+            rules with one of the obligations as unifyable """
+        tagged = set()
+        unifying = set()
+        for obligation in obligations:
+            base = obligation.split(' | ')[0]
+            i = self.bytag.get(base)
+            if i is not None and i in pending:
+                tagged.add(i)
+            unifying.update(self.byunifyable.get(base, ()))
+        return sorted(tagged), unifying
+
+    def unifyobligations(self, v, pending):
+        """ Apply the pending rules to a dict of obligations, rules the target of which is present in the dict are
+            applied here and not below, all others are applied to the attributes of the obligations """
+        runstats = currentstats.get()
+        if runstats is not None:
+            runstats.count('UnifyRules.unifyobligations')
+        candidates, unifying = self.candidates(v, pending)
+        if len(candidates) == 0:
+            for v1 in v.values():
+                if isinstance(v1, dict):
+                    self.unifyitems(v1, pending)
+            return
+        done = -1
+        applied = set()
+        for i in candidates:
+            tag = self.tags[i]
             tagrefs = ''
-            attribute = {}
-            for obligation, v1 in v.items():
+            for obligation in v:
                 if obligation.split(' | ')[0] == tag:
                     tagrefs = obligation
-                    attribute = v1
                     break
-            if tagrefs != '':
-                for obligation, v1 in v.copy().items():
-                    for unifyable in replacelist:
-                        if obligation.split(' | ')[0] == unifyable:
-                            d[k].pop(obligation)
-                            d[k].pop(tagrefs)
-                            if '|' in obligation:
-                                if '|' in tagrefs:
-                                    tagrefs += ', (' + unifyable + '): ' + obligation.split(' | ')[1]
-                                else:
-                                    tagrefs += ' | (' + unifyable + '): ' + obligation.split(' | ')[1]
-                            if attribute == {} and v1 == {}:
-                                d[k][tagrefs] = {}
-                            elif attribute == {} and v1 != {}:
-                                d[k][tagrefs] = v1
-                            elif attribute != {} and v1 == {}:
-                                d[k][tagrefs] = attribute
-                            else:
-                                d[k][tagrefs] = extend(v1, attribute, False, [], [], True)
-            else:
-                unifyobligations(v, tag, replacelist)
-        elif isinstance(v, list) and k in ['YOU MUST', 'YOU MUST NOT', 'ATTRIBUTE']:
+            if tagrefs == '':
+                continue
+            applied.add(i)
+            if i not in unifying or not any(obligation.split(' | ')[0] in self.replacelists[i] for obligation in v):
+                continue
+            below = tuple(j for j in pending if done < j < i and j not in applied)
+            if len(below) > 0:
+                for v1 in v.values():
+                    if isinstance(v1, dict):
+                        self.unifyitems(v1, below)
+            done = i
+            self.mergeobligations(v, tagrefs, self.replacelists[i])
+        below = tuple(j for j in pending if j > done and j not in applied)
+        if len(below) > 0:
+            for v1 in v.values():
+                if isinstance(v1, dict):
+                    self.unifyitems(v1, below)
+
+    def mergeobligations(self, v, tagrefs, replacelist):
+        """ Merge the unifyable obligations of a dict of obligations into the target obligation tagrefs """
+        attribute = v[tagrefs]
+        for obligation, v1 in v.copy().items():
+            for unifyable in replacelist:
+                if obligation.split(' | ')[0] == unifyable:
+                    v.pop(obligation)
+                    v.pop(tagrefs)
+                    if '|' in obligation:
+                        if '|' in tagrefs:
+                            tagrefs += ', (' + unifyable + '): ' + obligation.split(' | ')[1]
+                        else:
+                            tagrefs += ' | (' + unifyable + '): ' + obligation.split(' | ')[1]
+                    if attribute == {} and v1 == {}:
+                        v[tagrefs] = {}
+                    elif attribute == {} and v1 != {}:
+                        v[tagrefs] = v1
+                    elif attribute != {} and v1 == {}:
+                        v[tagrefs] = attribute
+                    else:
+                        v[tagrefs] = mergedicts(v1, attribute, True)
+
+    def unifylist(self, d, k, pending):
+        """ Apply the pending rules to a list of obligations d[k] """
+        candidates, unifying = self.candidates(d[k], pending)
+        for i in candidates:
+            tag = self.tags[i]
+            v = d[k]
             tagrefs = ''
             for obligation in v:
                 if obligation.split(' | ')[0] == tag:
@@ -551,7 +1048,7 @@ def unifyobligations(d, tag, replacelist):
                     break
             if tagrefs != '':
                 for obligation in v:
-                    for unifyable in replacelist:
+                    for unifyable in self.replacelists[i]:
                         if obligation.split(' | ')[0] == unifyable:
                             d[k].remove(obligation)
                             d[k].remove(tagrefs)
@@ -562,34 +1059,134 @@ def unifyobligations(d, tag, replacelist):
                                     tagrefs += ' | (' + unifyable + '): ' + obligation.split(' | ')[1]
                             d[k].append(tagrefs)
                             d[k] = sorted(d[k], key = lambda s: s.lower())
-        elif isinstance(v, dict):
-            unifyobligations(v, tag, replacelist)
 
 def unifylicenses(licenses, rules):
-    """ Open OSLOC files, convert them to JSON objects and store them as specified """
-    for k, v in rules.items():
-        unifyobligations(licenses, k, v)
-
-def getchain(obj, tabs, result):
-    if tabs <= 0:
-        return result
-    if isinstance(obj, dict):
-        if len(obj.keys()) == 0:
-            lastkey = ''
-            tabs = 0
+    """ Unify semantically similar obligations of a license or of a license tree in place according to the unify rules """
+    if not isinstance(rules, UnifyRules):
+        rules = UnifyRules(rules)
+    rules.apply(licenses)
+
+lowercasepattern = re.compile('[a-z]')
+
+class ChainTracker:
+    """ Keep track of the chain of last keys from the root of a license while it is being parsed
+
+        The chain is what walking down the tree along the last key of every dict yields. Every dict
+        on this path is indexed, so that inserting a key only needs to update the end of the path,
+        and the chain down to a given number of text levels is available without re-walking the tree. """
+
+    def __init__(self, data):
+        self.nodes = [data]
+        self.keys = []
+        self.chains = []
+        self.reach = []
+        self.leaf = None
+        self.positions = {id(data): 0}
+
+    def add(self, d, key, value):
+        """ Set d[key] to value and update the path, if the last key of a dict on the path has changed """
+        isnew = key not in d
+        d[key] = value
+        pos = self.positions.get(id(d))
+        if pos is None or (not isnew and (pos == len(self.keys) or self.keys[pos] != key)):
+            return
+        for node in self.nodes[pos + 1:]:
+            self.positions.pop(id(node), None)
+        del self.nodes[pos + 1:]
+        del self.keys[pos:]
+        del self.chains[pos:]
+        while len(self.reach) > 0 and self.reach[-1] >= pos:
+            self.reach.pop()
+        self.leaf = None
+
+        if pos == 0:
+            previous = ''
         else:
-            lastkey = list(obj.keys())[len(obj.keys()) - 1]
-    else:
-        lastkey = obj
-        tabs = 0
-    if result != '' and lastkey != '':
-        result += '.'
-    result += lastkey
-    if re.search('[a-z]', lastkey) or (lastkey == '1' and result.split('.')[-2] == 'OR'):
-        tabs -= 1
-    if isinstance(obj, dict) and lastkey != '':
-        return getchain(obj[lastkey], tabs, result)
-    return getchain(obj, tabs, result)
+            previous = self.chains[pos - 1]
+        if previous != '' and key != '':
+            chain = previous + '.' + key
+        else:
+            chain = previous + key
+        self.keys.append(key)
+        self.chains.append(chain)
+        if lowercasepattern.search(key) or (key == '1' and pos > 0 and previous[previous.rfind('.') + 1:] == 'OR'):
+            self.reach.append(pos)
+        if isinstance(value, dict):
+            if key != '':
+                self.positions[id(value)] = len(self.nodes)
+                self.nodes.append(value)
+        elif isinstance(value, str):
+            if value != '':
+                self.leaf = chain + '.' + value
+            else:
+                self.leaf = chain
+
+    def chain(self, tabs):
+        """ Return the chain of keys down to the specified number of text levels """
+        if tabs <= 0:
+            return ''
+        if tabs <= len(self.reach):
+            return self.chains[self.reach[tabs - 1]]
+        if self.leaf is not None:
+            return self.leaf
+        if len(self.chains) == 0:
+            return ''
+        return self.chains[-1]
+
+class OptTracker:
+    """ Convert the dicts of a license as optjson() does while it is being parsed, without changing the license
+
+        A dict that a line is added below is open until a line is added to one of the dicts it was opened below, when
+        it is closed, and a converted copy of it is made from the copies of the dicts closed below it. If a line is
+        added to a dict closed already, as after some indentation errors, the copies are dropped, and the license
+        is copied and converted as a whole at the end. """
+
+    def __init__(self, data):
+        self.opened = [data]
+        self.closed = {}
+        self.reopened = False
+
+    def add(self, parent, d):
+        """ Close the dicts opened after the dict parent, that a line has been added to, and open the dict d below it """
+        if self.reopened:
+            return
+        i = len(self.opened) - 1
+        while i >= 0 and self.opened[i] is not parent:
+            i -= 1
+        if i < 0:
+            self.reopened = True
+            self.closed = {}
+            return
+        while len(self.opened) > i + 1:
+            self.close()
+        self.opened.append(d)
+
+    def close(self):
+        """ Close the dict opened last """
+        d = self.opened.pop()
+        # Keep d, so that its id is not reused by a dict created later, if a line replaces it in the license
+        self.closed[id(d)] = (d, self.copy(d))
+
+    def copy(self, d):
+        """ Return a copy of a dict with its values converted as optjson() converts them """
+        new = {}
+        for k, v in d.items():
+            if v:
+                if isinstance(v, dict):
+                    if id(v) in self.closed:
+                        v = self.closed[id(v)][1]
+                    else:
+                        v = self.copy(v)
+                v = optvalue(v)
+            new[k] = v
+        return new
+
+    def finish(self):
+        """ Close all dicts and return the converted copy of the license """
+        if not self.reopened:
+            while len(self.opened) > 1:
+                self.close()
+        return self.copy(self.opened[0])
 
 def check_duplicates(ordered_pairs):
     d = {}
@@ -600,15 +1197,891 @@ def check_duplicates(ordered_pairs):
            d[k] = v
     return d
 
-def osloc2json(licensefilenames, outfilename, json, args):
-    """ Open OSLOC files, convert them to JSON objects and store them as specified """
+oslocpattern = re.compile('(USE CASE)|\t*(YOU MUST NOT|YOU MUST|ATTRIBUTE|IF|EXCEPT IF|EITHER IF|OR IF|EITHER|OR)|(PATENT HINTS|COPYLEFT CLAUSE|COMPATIBILITY|DEPENDING COMPATIBILITY|INCOMPATIBILITY)')
+remarkpattern = re.compile(r' \(.*\)')
+
+def parseosloc(oslocfile, licensename, data, globaleitherchains, globaleitherifchains, version, devel, verbose, chainlog = None, optimized = None):
+    """ Parse the lines of an OSLOC file into data, return the number of lines parsed, raise OSLOCSyntaxError in case of a syntax error
+
+        With a chain log, the EITHER and EITHER IF chains are not numbered by the chain counters, but by placeholders,
+        and the tag and the chain of every chain are appended to the chain log, so that renumberchains() can number
+        them later on as if the license were parsed at that point. With a dict optimized, the values of data are
+        converted as optjson() converts them by an OptTracker while the lines are parsed, and stored in optimized. """
+    lineno = 0
+    empty = True
+    orlevels = {}
+    eitherextratabs = 0
+    oriflevels = {}
+    eitherifextratabs = 0
+    parents = {}
+    tracker = ChainTracker(data)
+    opttracker = None
+    if optimized is not None:
+        opttracker = OptTracker(data)
+    for line in oslocfile:
+        empty = False
+        if line.endswith('\n'):
+            line = line[:-1]
+        if len(line) == 0:
+            continue
+        lineno += 1
+        if line.startswith(' '):
+            raise OSLOCSyntaxError('Syntax error (leading space) detected in license %r at line %d, output will be incomplete' % (licensename, lineno), licensename, lineno)
+        if '(' in line:
+            line = remarkpattern.sub('', line)
+        if verbose:
+            print(line)
+        tabs = line.count('\t')
+        if devel:
+            print(tabs, orlevels)
+        tag = ''
+        text = ''
+        match = oslocpattern.match(line)
+        if match is None:
+            raise OSLOCSyntaxError('Unidentified or erroneously positioned language element in license %r at line %d' % (licensename, lineno), licensename, lineno, line)
+        if match.group(1) is not None:
+            tag = 'USE CASE'
+            text = line[9:]
+            if tag not in data:
+                tracker.add(data, tag, {})
+            parents[tabs + 1] = {}
+            tracker.add(data[tag], text, parents[tabs + 1])
+            if opttracker is not None:
+                opttracker.add(data, parents[tabs + 1])
+            if devel:
+                print(data[tag])
+            eitherextratabs = 0
+            continue
+        if match.group(2) is not None:
+            tag = match.group(2)
+            text = line[match.end(2) + 1:]
+        else:
+            tag = match.group(3)
+            text = line[len(tag) + 1:]
+        if tabs == 0 and (text == 'Yes' or text == 'No' or text == 'Questionable' or tag.find('COMPATIBILITY') != -1):
+            if tag not in data:
+                tracker.add(data, tag, text)
+                if devel:
+                    print(data[tag])
+            else:
+                if isinstance(data[tag], str):
+                    tracker.add(data, tag, [data[tag]])
+                data[tag].append(text)
+                if devel:
+                    print(data[tag])
+            continue
+
+        if len(parents) == 0 or (tabs == 0 and tag != 'USE CASE'):
+            raise OSLOCSyntaxError('Syntax error (illegal position of tag %r), detected in license %r at line %d, output will be incomplete' % (tag, licensename, lineno), licensename, lineno)
+
+        if tag == 'EITHER':
+            totalchain = tracker.chain(tabs) + '.' + tag
+            if chainlog is not None:
+                text = '\0%d\0' % len(chainlog)
+                chainlog.append([tag, totalchain])
+            else:
+                if totalchain not in globaleitherchains:
+                    globaleitherchains[totalchain] = 1
+                else:
+                    globaleitherchains[totalchain] += 1
+                text = str(globaleitherchains[totalchain])
+            for k in orlevels.copy():
+                if tabs <= k:
+                    orlevels.pop(k)
+                    if eitherextratabs > 0:
+                        eitherextratabs -= 1
+            orlevels[tabs] = 0
+        if tag == 'OR':
+            if tabs not in orlevels:
+                raise OSLOCSyntaxError('Syntax error (OR before EITHER) detected in license %r at line %d, output will be incomplete' % (licensename, lineno), licensename, lineno)
+            orlevels[tabs] += 1
+            text = str(orlevels[tabs])
+            if orlevels[tabs] == 1:
+                eitherextratabs += 1
+        if tag != 'EITHER':
+            if len(orlevels) > 0:
+                for k in orlevels.copy():
+                    if (tag == 'OR' and tabs < k) or (tag != 'OR' and tabs <= k):
+                        orlevels.pop(k)
+                        if eitherextratabs > 0:
+                            eitherextratabs -= 1
+
+        if version > 1:
+            if tag == 'EITHER IF':
+                eitheroriftext = text
+                totalchain = tracker.chain(tabs) + '.' + tag
+                if chainlog is not None:
+                    text = '\0%d\0' % len(chainlog)
+                    chainlog.append([tag, totalchain])
+                else:
+                    if totalchain in globaleitherifchains:
+                        globaleitherifchains[totalchain] += 1
+                    else:
+                        globaleitherifchains[totalchain] = 1
+                    text = str(globaleitherifchains[totalchain])
+                for k in oriflevels.copy():
+                    if tabs <= k:
+                        oriflevels.pop(k)
+                        if eitherifextratabs > 0:
+                            eitherifextratabs -= 1
+                oriflevels[tabs] = 0
+            if tag == 'OR IF':
+                eitheroriftext = text
+                if tabs not in oriflevels:
+                    raise OSLOCSyntaxError('Syntax error (OR IF before EITHER IF) detected in license %r at line %d, output will be incomplete' % (licensename, lineno), licensename, lineno)
+                oriflevels[tabs] += 1
+                text = str(oriflevels[tabs])
+                if oriflevels[tabs] == 1:
+                    eitherifextratabs += 1
+            if tag != 'EITHER IF':
+                if len(oriflevels) > 0:
+                    for k in oriflevels.copy():
+                        if (tag == 'OR IF' and tabs < k) or (tag != 'OR IF' and tabs <= k):
+                            oriflevels.pop(k)
+                            if eitherifextratabs > 0:
+                                eitherifextratabs -= 1
+
+        level = tabs + eitherextratabs + eitherifextratabs
+        if level in parents:
+            if tag not in parents[level]:
+                tracker.add(parents[level], tag, {})
+            parents[level + 1] = {}
+            tracker.add(parents[level][tag], text, parents[level + 1])
+            if devel:
+                print(parents[level][tag])
+
+        if version > 1:
+            if tag in ['EITHER IF', 'OR IF']:
+                parents[level + 1] = {}
+                tracker.add(parents[level][tag][text], eitheroriftext, parents[level + 1])
+                if devel:
+                    print(parents[level][tag][text])
+
+        if opttracker is not None and level in parents:
+            opttracker.add(parents[level], parents[level + 1])
+
+    if empty:
+        if verbose:
+            print('')
+        if devel:
+            print(0, orlevels)
+        raise OSLOCSyntaxError('Unidentified or erroneously positioned language element in license %r at line %d' % (licensename, 1), licensename, 1, '')
+    if opttracker is not None:
+        optimized.update(opttracker.finish())
+    return lineno
+
+chainplaceholderpattern = re.compile('\0([0-9]+)\0')
+
+def renumberchains(data, chainlog, globaleitherchains, globaleitherifchains):
+    """ Number the chains of a license parsed with a chain log by the chain counters in place and update the counters
+
+        The chains are counted in the order they were parsed, and the placeholders of the chains they are nested in
+        are replaced in their chains first, so that the license is numbered as if it were parsed with the counters. """
+    numbers = []
+    for tag, totalchain in chainlog:
+        if '\0' in totalchain:
+            totalchain = chainplaceholderpattern.sub(lambda match: numbers[int(match.group(1))], totalchain)
+        if tag == 'EITHER':
+            chains = globaleitherchains
+        else:
+            chains = globaleitherifchains
+        chains[totalchain] = chains.get(totalchain, 0) + 1
+        numbers.append(str(chains[totalchain]))
+    if len(numbers) > 0:
+        replacechainplaceholders(data, numbers)
+
+def replacechainplaceholders(d, numbers):
+    """ Replace the placeholders of the chains below a dict by their numbers """
+    for k, v in d.items():
+        if isinstance(v, dict):
+            if k in ['EITHER', 'EITHER IF'] and any(k2.startswith('\0') for k2 in v):
+                v = {chainplaceholderpattern.sub(lambda match: numbers[int(match.group(1))], k2): v2 for k2, v2 in v.items()}
+                d[k] = v
+            replacechainplaceholders(v, numbers)
+
+def parsekey(osloc, version, upgrade = None, relative = False, toolversion = ''):
+    """ Return the key of an OSLOC text in the parse cache or memo, and of the obligations added to it, if it is an
+        upgraded license, and whether it is parsed with a chain log """
+    h = hashlib.sha256()
+    h.update(toolversion.encode('utf-8'))
+    h.update(('\0%d\0' % version).encode('utf-8'))
+    h.update(osloc.encode('utf-8', 'surrogateescape'))
+    if upgrade:
+        h.update(('\0upgrade\0' + '\0'.join(upgrade)).encode('utf-8'))
+    if relative:
+        h.update(b'\0relative\0')
+    return h.hexdigest()
+
+class ParseCache:
+    """ Content-addressed on-disk cache of parsed OSLOC files
+
+        An entry is keyed by the hash of the OSLOC text, the data structure version and the version of
+        this program. Since the numbering of EITHER and EITHER IF chains continues across the licenses
+        of a run, an entry may hold several variants of a license; each variant records the chain
+        counters it has read and written and is only used if the current counters match. """
+
+    maxvariants = 8
+
+    def __init__(self, cachedir, maxsize):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.size = None
+        self.toolversion = ParseCache.gettoolversion()
+
+    @staticmethod
+    def gettoolversion():
+        """ Return the hash of this program's source as its version """
+        try:
+            sourcefile = open(__file__, 'rb')
+        except:
+            return ''
+        toolversion = hashlib.sha256(sourcefile.read()).hexdigest()
+        sourcefile.close()
+        return toolversion
+
+    @staticmethod
+    def defaultdir():
+        """ Return the default cache directory """
+        if 'XDG_CACHE_HOME' in os.environ:
+            return os.path.join(os.environ['XDG_CACHE_HOME'], 'osloc2json')
+        return os.path.join(os.path.expanduser('~'), '.cache', 'osloc2json')
+
+    def key(self, osloc, version, upgrade = None, relative = False):
+        """ Return the cache key of an OSLOC text, see parsekey() """
+        return parsekey(osloc, version, upgrade, relative, self.toolversion)
+
+    def filename(self, key):
+        return os.path.join(self.cachedir, key + '.json')
+
+    def readvariants(self, key):
+        try:
+            cachefile = open(self.filename(key), 'r')
+        except:
+            return []
+        try:
+            variants = json.load(cachefile)
+        except ValueError:
+            variants = []
+        cachefile.close()
+        if not isinstance(variants, list):
+            return []
+        return variants
+
+    @staticmethod
+    def matchvariant(variants, globaleitherchains, globaleitherifchains):
+        """ Return the variant matching the current chain counters and update the counters """
+        for variant in variants:
+            if all(globaleitherchains.get(k, 0) == v for k, v in variant['eitherchains'].items()) and \
+              all(globaleitherifchains.get(k, 0) == v for k, v in variant['eitherifchains'].items()):
+                globaleitherchains.update(variant['eitherchainsout'])
+                globaleitherifchains.update(variant['eitherifchainsout'])
+                return variant
+        return None
+
+    @staticmethod
+    def mkvariant(data, eitherchainsbefore, eitherifchainsbefore, globaleitherchains, globaleitherifchains):
+        """ Return a variant of a parsed license with the chain counters it has read and written """
+        variant = {'eitherchains': {}, 'eitherifchains': {}, 'eitherchainsout': {}, 'eitherifchainsout': {}, 'data': data}
+        for before, after, read, written in [(eitherchainsbefore, globaleitherchains, 'eitherchains', 'eitherchainsout'),
+          (eitherifchainsbefore, globaleitherifchains, 'eitherifchains', 'eitherifchainsout')]:
+            for k, v in after.items():
+                if before.get(k, 0) != v:
+                    variant[read][k] = before.get(k, 0)
+                    variant[written][k] = v
+        return variant
+
+    def get(self, key, globaleitherchains, globaleitherifchains):
+        """ Return the parsed license, if a variant matching the current chain counters is cached, and update the counters """
+        variant = ParseCache.matchvariant(self.readvariants(key), globaleitherchains, globaleitherifchains)
+        if variant is None:
+            return None
+        try:
+            os.utime(self.filename(key), None)
+        except OSError:
+            pass
+        return variant['data']
+
+    def put(self, key, data, eitherchainsbefore, eitherifchainsbefore, globaleitherchains, globaleitherifchains):
+        """ Store a parsed license together with the chain counters it has read and written """
+        variant = ParseCache.mkvariant(data, eitherchainsbefore, eitherifchainsbefore, globaleitherchains, globaleitherifchains)
+        variants = [variant] + self.readvariants(key)[:ParseCache.maxvariants - 1]
+        self.write(key, variants)
+
+    def getrelative(self, key):
+        """ Return a license parsed with a chain log and the chain log, if cached, or None """
+        try:
+            cachefile = open(self.filename(key), 'r')
+        except:
+            return None
+        try:
+            entry = json.load(cachefile)
+        except ValueError:
+            entry = None
+        cachefile.close()
+        if not isinstance(entry, dict) or 'data' not in entry or 'chainlog' not in entry:
+            return None
+        try:
+            os.utime(self.filename(key), None)
+        except OSError:
+            pass
+        return entry['data'], entry['chainlog']
+
+    def putrelative(self, key, data, chainlog):
+        """ Store a license parsed with a chain log together with the chain log """
+        self.write(key, {'data': data, 'chainlog': chainlog})
+
+    def write(self, key, entry):
+        """ Write a cache entry and remove least recently used entries, if the cache has grown too large """
+        try:
+            os.makedirs(self.cachedir, exist_ok = True)
+            tmpfilename = self.filename(key) + '.%d.tmp' % os.getpid()
+            cachefile = open(tmpfilename, 'w')
+            json.dump(entry, cachefile)
+            cachefile.close()
+            os.replace(tmpfilename, self.filename(key))
+            size = os.path.getsize(self.filename(key))
+        except OSError as e:
+            print('Cannot write to cache %r: %s' % (self.cachedir, e))
+            return
+        if self.size is None:
+            self.size = sum(e[1] for e in self.entries())
+        else:
+            self.size += size
+        if self.size > self.maxsize:
+            self.prune()
+
+    def entries(self):
+        """ Return (mtime, size, filename) of all cache entries, least recently used first """
+        result = []
+        try:
+            names = os.listdir(self.cachedir)
+        except OSError:
+            return result
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            filename = os.path.join(self.cachedir, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            result.append((st.st_mtime, st.st_size, filename))
+        return sorted(result)
+
+    def prune(self):
+        """ Remove least recently used entries until the cache size is within its limit """
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for mtime, size, filename in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+
+    def clear(self):
+        """ Remove all cache entries """
+        for mtime, size, filename in self.entries():
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+class ParseMemo(ParseCache):
+    """ In-memory counterpart of the parse cache, used by batch runs to parse every variant of a license only once
+
+        The parsed licenses are held encoded by a Vocabulary and decoded into new data when returned, since the
+        caller modifies them. A license parsed with a chain log matches any chain counters, and its chains are
+        numbered by the counters when it is returned. """
+
+    def __init__(self, vocabulary = None):
+        self.toolversion = ''
+        self.variants = {}
+        self.relative = {}
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        self.vocabulary = vocabulary
+
+    def get(self, key, globaleitherchains, globaleitherifchains):
+        variant = ParseCache.matchvariant(self.variants.get(key, []), globaleitherchains, globaleitherifchains)
+        if variant is not None:
+            return self.vocabulary.decode(variant['data'])
+        if key in self.relative:
+            data, chainlog = self.relative[key]
+            data = self.vocabulary.decode(data)
+            renumberchains(data, chainlog, globaleitherchains, globaleitherifchains)
+            return data
+        return None
+
+    def putrelative(self, key, data, chainlog):
+        self.relative[key] = (self.vocabulary.encode(data), chainlog)
+
+    def put(self, key, data, eitherchainsbefore, eitherifchainsbefore, globaleitherchains, globaleitherifchains):
+        variant = ParseCache.mkvariant(self.vocabulary.encode(data), eitherchainsbefore, eitherifchainsbefore, globaleitherchains, globaleitherifchains)
+        self.variants.setdefault(key, []).append(variant)
+
+class MergeCache(ParseCache):
+    """ Cache of intermediate results of merging licenses
+
+        An entry is keyed by the hashes of the licenses merged so far in the order they were merged and by the
+        unify flag, so that a merge starts from the result of the longest sequence of its first licenses that was
+        merged before. Since the licenses are hashed after they were converted, expanded and optimized, the
+        key covers these options as well. Recently used entries are also kept in memory, encoded by a Vocabulary
+        that may be shared with a parse memo; without a cache directory, they are only kept in memory. """
+
+    maxmemoryentries = 256
+
+    def __init__(self, cachedir, maxsize, vocabulary = None):
+        ParseCache.__init__(self, cachedir, maxsize)
+        self.memory = collections.OrderedDict()
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        self.vocabulary = vocabulary
+
+    def key(self, previouskey, licensedata, unify):
+        """ Return the cache key of the merge of a license with the licenses of the previous key """
+        h = hashlib.sha256()
+        h.update(('merge\0%s\0%s\0%d\0' % (self.toolversion, previouskey, unify)).encode('utf-8'))
+        h.update(json.dumps(licensedata).encode('utf-8', 'surrogateescape'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """ Return a copy of a cached merge result or None """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.vocabulary.decode(self.memory[key])
+        if self.cachedir is None:
+            return None
+        try:
+            cachefile = open(self.filename(key), 'r')
+        except:
+            return None
+        try:
+            data = json.load(cachefile)
+        except ValueError:
+            data = None
+        cachefile.close()
+        if not isinstance(data, dict):
+            return None
+        try:
+            os.utime(self.filename(key), None)
+        except OSError:
+            pass
+        self.remember(key, data)
+        return data
+
+    def put(self, key, data):
+        """ Store a copy of a merge result """
+        self.remember(key, data)
+        if self.cachedir is not None:
+            self.write(key, data)
+
+    def remember(self, key, data):
+        """ Keep an encoded copy of a merge result in memory """
+        self.memory[key] = self.vocabulary.encode(data)
+        self.memory.move_to_end(key)
+        while len(self.memory) > MergeCache.maxmemoryentries:
+            self.memory.popitem(last = False)
+
+class ValidatorCache(ParseCache):
+    """ Cache of validators generated by fastjsonschema from the OSLOC schema
+
+        An entry holds the compiled code of a validator, since generating and compiling it takes much longer than
+        validating a file. It is keyed by the hash of the schema, the version of fastjsonschema and the bytecode
+        version of Python. """
+
+    def key(self, schemadata):
+        """ Return the cache key of the validator of a schema """
+        import fastjsonschema
+        import importlib.util
+
+        h = hashlib.sha256()
+        h.update(('validator\0%s\0' % fastjsonschema.VERSION).encode('utf-8'))
+        h.update(importlib.util.MAGIC_NUMBER)
+        h.update(json.dumps(schemadata, sort_keys = True).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """ Return the code object of a cached validator or None """
+        try:
+            cachefile = open(self.filename(key), 'r')
+        except:
+            return None
+        try:
+            entry = json.load(cachefile)
+        except ValueError:
+            entry = None
+        cachefile.close()
+        try:
+            code = marshal.loads(base64.b64decode(entry['code']))
+        except (TypeError, KeyError, ValueError, EOFError):
+            return None
+        try:
+            os.utime(self.filename(key), None)
+        except OSError:
+            pass
+        return code
+
+    def put(self, key, code):
+        """ Store the code object of a validator """
+        self.write(key, {'code': base64.b64encode(marshal.dumps(code)).decode('ascii')})
+
+def parseoslocfile(oslocfile, licensename, data, globaleitherchains, globaleitherifchains, version, devel, verbose, parsecache, upgrade = None, optimize = False):
+    """ Parse an OSLOC file like parseosloc(), but take the result from the parse cache, if available, and
+        print syntax errors and return -1 instead of raising them
+
+        The obligations in upgrade, if any, are added to the license as to an upgraded license, and the
+        upgraded license is cached. With optimize, which is not combined with upgrade, the values of data are
+        converted as optjson() converts them while the license is parsed, or afterwards, if it is taken from the
+        cache; the cache holds the license as parsed. """
+    optimized = None
+    if optimize:
+        optimized = {}
+    try:
+        if parsecache is None:
+            lineno = parseosloc(oslocfile, licensename, data, globaleitherchains, globaleitherifchains, version, devel, verbose, None, optimized)
+            if upgrade:
+                upgradelicense(data, upgrade)
+        else:
+            osloc = oslocfile.read()
+            key = parsecache.key(osloc, version, upgrade)
+            cached = parsecache.get(key, globaleitherchains, globaleitherifchains)
+            if cached is not None:
+                data.update(cached)
+                if optimize:
+                    optjson(data)
+                return osloc.count('\n')
+            eitherchainsbefore = globaleitherchains.copy()
+            eitherifchainsbefore = globaleitherifchains.copy()
+            lineno = parseosloc(io.StringIO(osloc), licensename, data, globaleitherchains, globaleitherifchains, version, devel, verbose, None, optimized)
+            if upgrade:
+                upgradelicense(data, upgrade)
+            parsecache.put(key, data, eitherchainsbefore, eitherifchainsbefore, globaleitherchains, globaleitherifchains)
+        if optimize:
+            data.clear()
+            data.update(optimized)
+        return lineno
+    except OSLOCSyntaxError as e:
+        print(e)
+        if e.line is not None and not verbose:
+            print(e.line)
+        return -1
+
+class UpgradeRules:
+    """ License upgrade rules compiled from "licenseupgraderules.json"
+
+        Every rule maps the SPDX identifier of a license to the identifier of the license it can be upgraded to
+        and to the obligations that the upgraded license gets in addition. Licenses are matched by the identifier
+        in their file name, and the upgraded license is read from the file of the same name in the same directory. """
+
+    def __init__(self, rules):
+        if isinstance(rules, UpgradeRules):
+            rules = rules.rules
+        if not isinstance(rules, dict):
+            raise OSLOCError('Upgrade rules must be a dict of licenses and upgrades')
+        self.rules = rules
+        self.upgrades = {}
+        self.obligations = {}
+        for oldlicense, value in rules.items():
+            if not isinstance(value, list) or len(value) not in [1, 2] or not all(isinstance(s, str) for s in value):
+                raise OSLOCError('Upgrade rule %r must map to a list of the upgraded license and its obligations' % oldlicense)
+            newlicense = value[0]
+            if newlicense == oldlicense:
+                raise OSLOCError('Upgrade rule %r upgrades the license to itself' % oldlicense)
+            obligations = ()
+            if len(value) == 2:
+                obligations = tuple(obligation.replace('YOU MUST ', '') for obligation in value[1].split(',') if obligation.find('YOU MUST ') != -1)
+            if newlicense in self.obligations and self.obligations[newlicense] != obligations:
+                raise OSLOCError('Upgrade rules to license %r add different obligations' % newlicense)
+            self.upgrades[oldlicense] = newlicense
+            self.obligations[newlicense] = obligations
+        for oldlicense, newlicense in self.upgrades.items():
+            if newlicense in self.upgrades:
+                raise OSLOCError('Upgrade rule %r upgrades to license %r which is upgraded itself' % (oldlicense, newlicense))
+
+    def upgradefilename(self, licensefilename):
+        """ Return the file name of the upgraded license and the identifiers of the licenses upgraded to """
+        dirname, basename = os.path.split(licensefilename)
+        licensename, suffix = os.path.splitext(basename)
+        tail = ''
+        for marker in ['-opt', '.unified']:
+            if licensename.endswith(marker):
+                licensename = licensename[:-len(marker)]
+                tail = marker + tail
+        upgraded = []
+        names = licensename.split('+')
+        for i, name in enumerate(names):
+            if name in self.upgrades:
+                names[i] = self.upgrades[name]
+                upgraded.append(names[i])
+        if len(upgraded) == 0:
+            return licensefilename, upgraded
+        return os.path.join(dirname, '+'.join(names) + tail + suffix), upgraded
+
+    def upgradefilenames(self, licensefilenames):
+        """ Replace the file names of upgradable licenses by those of the upgraded ones, return the sorted file names
+            and a dict of the upgraded licenses and the obligations to add to them """
+        addobligations = {}
+        newlicensefilenames = []
+        for licensefilename in licensefilenames:
+            newlicensefilename, upgraded = self.upgradefilename(licensefilename)
+            for newlicense in upgraded:
+                addobligations[newlicense] = self.obligations[newlicense]
+            if newlicensefilename == licensefilename or (newlicensefilename not in licensefilenames and newlicensefilename not in newlicensefilenames):
+                newlicensefilenames.append(newlicensefilename)
+        return sorted(newlicensefilenames, key = lambda s: s.lower()), addobligations
+
+def upgradelicense(data, obligations):
+    """ Add the obligations of an upgraded license to every use case of the license in place """
+    for usecase in data.get('USE CASE', {}).values():
+        if 'YOU MUST' not in usecase:
+            usecase['YOU MUST'] = {}
+        for obligation in obligations:
+            if obligation not in usecase['YOU MUST']:
+                usecase['YOU MUST'][obligation] = {}
+
+def loadupgraderules(json):
+    """ Load and compile the upgrade rules from "licenseupgraderules.json" in the current or in the parent directory, return None if
+        not possible """
+    rulesfilename = 'licenseupgraderules.json'
+    try:
+        rulesfile = open(rulesfilename, 'r')
+    except:
+        try:
+            rulesfile = open('../' + rulesfilename, 'r')
+        except:
+            print('Upgrade rules file %r not found or not accessible in current or in parent directory' % rulesfilename)
+            return None
+    try:
+        rules = json.load(rulesfile)
+    except json.decoder.JSONDecodeError as e:
+        print(e)
+        print('Upgrade rules file %r has no valid JSON format, skipped step attempting to upgrade licenses' % rulesfilename)
+        rules = None
+    rulesfile.close()
+    if rules is None:
+        return None
+    try:
+        return UpgradeRules(rules)
+    except OSLOCError as e:
+        print(e)
+        print('Upgrade rules file %r has invalid rules, skipped step attempting to upgrade licenses' % rulesfilename)
+        return None
+
+def upgradelicensefilenames(licensefilenames, json, upgraderules = None):
+    """ Replace license file names according to the upgrade rules, return them together with the obligations to add
+
+        The upgrade rules are loaded from file, if none are given. """
+    if upgraderules is None:
+        upgraderules = loadupgraderules(json)
+        if upgraderules is None:
+            return licensefilenames, {}
+    return upgraderules.upgradefilenames(licensefilenames)
+
+def loadunifyrules(json):
+    """ Load and compile the unify rules from "unifyrules.json" in the current or in the parent directory, return None if
+        not possible """
+    rulesfilename = 'unifyrules.json'
+    try:
+        rulesfile = open(rulesfilename, 'r')
+    except:
+        try:
+            rulesfile = open('../' + rulesfilename, 'r')
+        except:
+            print('Unify rules file %r not found or not accessible in current or in parent directory' % rulesfilename)
+    try:
+        rules = json.load(rulesfile)
+        rulesfile.close()
+    except:
+        print('Cannot unify')
+        return None
+    try:
+        return UnifyRules(rules)
+    except OSLOCError as e:
+        print(e)
+        print('Cannot unify')
+        return None
+
+def mergejsondata(jsondata, unify, optimize, verbose, json, mergecache, unifyrules = None):
+    """ Merge all licenses into a single one, return the merged license names, the merged license and the merged license with license references
+
+        The unify rules are loaded from file, if unify is set, but no unify rules are given. """
+    allrefs = {}
+    copyleft_licenses = []
+    mergednames = ''
+    mergedlicenses = []
+    compatibilities = {}
+    depending_compatibilities = {}
+    for licensename in jsondata:
+        # The licenses are shared with jsondata and not modified by the merge, only top-level keys and empty use
+        # cases are added, so these are copied
+        licensedata = dict(jsondata[licensename])
+        if 'USE CASE' in licensedata:
+            chain = ['USE CASE']
+            if isemptyusecase(chain, licensedata['USE CASE']):
+                Nonetext = 'Not do anything else'
+                if isinstance(licensedata['USE CASE'], list):
+                    oldlist = licensedata['USE CASE']
+                    licensedata['USE CASE'] = {}
+                    for usecase in oldlist:
+                        licensedata['USE CASE'][usecase] = {}
+                        licensedata['USE CASE'][usecase]['YOU MUST'] = Nonetext
+                elif isinstance(licensedata['USE CASE'], dict):
+                    licensedata['USE CASE'] = dict(licensedata['USE CASE'])
+                    for usecase in licensedata['USE CASE']:
+                        if licensedata['USE CASE'][usecase] == {}:
+                            licensedata['USE CASE'][usecase] = {'YOU MUST': Nonetext}
+        if 'COMPATIBILITY' in licensedata:
+            if isinstance(licensedata['COMPATIBILITY'], str):
+                all = [licensedata['COMPATIBILITY']]
+            elif isinstance(licensedata['COMPATIBILITY'], list):
+                all = licensedata['COMPATIBILITY']
+            for compatibility in all:
+                if compatibility not in compatibilities:
+                    compatibilities[compatibility] = 1
+                else:
+                    compatibilities[compatibility] += 1
+        if 'DEPENDING COMPATIBILITY' in licensedata:
+            if isinstance(licensedata['DEPENDING COMPATIBILITY'], str):
+                all = [licensedata['DEPENDING COMPATIBILITY']]
+            elif isinstance(licensedata['DEPENDING COMPATIBILITY'], list):
+                all = licensedata['DEPENDING COMPATIBILITY']
+            for compatibility in all:
+                if compatibility not in depending_compatibilities:
+                    depending_compatibilities[compatibility] = 1
+                else:
+                    depending_compatibilities[compatibility] += 1
+        if 'COPYLEFT CLAUSE' not in licensedata:
+            licensedata['COPYLEFT CLAUSE'] = 'No'
+        else:
+            copyleft_licenses.append(licensename)
+        if 'PATENT HINTS' not in licensedata:
+            licensedata['PATENT HINTS'] = 'No'
+        if mergednames == '':
+            mergednames = licensename
+        else:
+            mergednames = mergednames + '|' + licensename
+            if verbose:
+                print(mergednames)
+        allrefs[licensename] = licensedata
+        mergedlicenses.append(licensedata)
+    with Phase('merge'):
+        new = mergelicenses(mergedlicenses, unify, mergecache)
+
+    copyleft_licenses = sorted(copyleft_licenses, key = lambda s: s.lower())
+
+    new['COMPATIBILITY'] = []
+    for k, v in compatibilities.items():
+        if v == len(copyleft_licenses):
+            new['COMPATIBILITY'].append(k)
+    if len(new['COMPATIBILITY']) == 0:
+        new.pop('COMPATIBILITY')
+    new['DEPENDING COMPATIBILITY'] = []
+    for k, v in depending_compatibilities.items():
+        if v == len(copyleft_licenses):
+            new['DEPENDING COMPATIBILITY'].append(k)
+    if len(new['DEPENDING COMPATIBILITY']) == 0:
+        new.pop('DEPENDING COMPATIBILITY')
+
+    with Phase('lrefs'):
+        newrefs = addlrefs(new, mklicenserefs(new, allrefs))
+
+    if 'INCOMPATIBILITY' in new or len(copyleft_licenses) > 0:
+        incompatible_licensesrefs = []
+        incompatible_licenses = []
+
+        names = mergednames.split('|')
+        if 'INCOMPATIBILITY' in new:
+            for license in names:
+                if license in new['INCOMPATIBILITY']:
+                    for reflicense in newrefs['INCOMPATIBILITY']:
+                        if license == reflicense.split(' | ')[0]:
+                            incompatible_licensesrefs.append(reflicense)
+                            incompatible_licenses.append(license)
+
+        for copyleft_license in copyleft_licenses.copy():
+            if 'COMPATIBILITY' not in new or ('COMPATIBILITY' in new and copyleft_license not in new['COMPATIBILITY']):
+                incompatible_copyleft_licenses_str = ''
+                for copyleft_license2 in copyleft_licenses.copy():
+                    if copyleft_license2 == copyleft_license:
+                        continue
+                    if 'COMPATIBILITY' in jsondata[copyleft_license2] and copyleft_license in jsondata[copyleft_license2]['COMPATIBILITY']:
+                        continue
+                    if incompatible_copyleft_licenses_str != '':
+                        incompatible_copyleft_licenses_str += ', '
+                    incompatible_copyleft_licenses_str += copyleft_license2
+                if incompatible_copyleft_licenses_str != '':
+                    incompatible_licensesrefs.append(copyleft_license + ' | If licensed under ' + incompatible_copyleft_licenses_str)
+                    if copyleft_license not in incompatible_licenses:
+                        incompatible_licenses.append(copyleft_license)
+        if len(incompatible_licenses) > 0:
+            incompatible_licenses = sorted(incompatible_licenses, key = lambda s: s.lower())
+            new['INCOMPATIBLE LICENSES'] = incompatible_licenses
+            newrefs['INCOMPATIBLE LICENSES'] = incompatible_licensesrefs
+
+    if 'INCOMPATIBLE LICENSES' not in new or ('INCOMPATIBLE LICENSES' in new and not commonlistitem(copyleft_licenses, new['INCOMPATIBLE LICENSES'])):
+        for copyleft_license in copyleft_licenses:
+            if 'COMPATIBILITY' not in new or ('COMPATIBILITY' in new and copyleft_license not in new['COMPATIBILITY']):
+                ref = ' | ' + copyleft_license + ' (only copyleft license)'
+                if 'COMPATIBILITY' not in new:
+                    new['COMPATIBILITY'] = [copyleft_license]
+                    newrefs['COMPATIBILITY'] = [copyleft_license + ref]
+                elif isinstance(new['COMPATIBILITY'], str):
+                    new['COMPATIBILITY'] = [new['COMPATIBILITY'], copyleft_license]
+                    newrefs['COMPATIBILITY'] = [newrefs['COMPATIBILITY'], copyleft_license + ref]
+                else:
+                    new['COMPATIBILITY'].append(copyleft_license)
+                    newrefs['COMPATIBILITY'].append(copyleft_license + ref)
+                new['COMPATIBILITY'] = sorted(new['COMPATIBILITY'], key = lambda s: s.lower())
+                newrefs['COMPATIBILITY'] = sorted(newrefs['COMPATIBILITY'], key = lambda s: s.lower())
+
+    if unify:
+        if unifyrules is None:
+            unifyrules = loadunifyrules(json)
+        if unifyrules is not None:
+            with Phase('unify'):
+                unifylicenses(newrefs, unifyrules)
+                unifylicenses(new, unifyrules)
+
+    if optimize:
+        with Phase('optimize'):
+            optjson(new)
+
+    with Phase('uniq'):
+        uniq(new)
+        uniq(newrefs)
+
+    if len(copyleft_licenses) > 0:
+        new['COPYLEFT LICENSES'] = copyleft_licenses
+    return mergednames, new, newrefs
+
+def splitlicensefilename(licensefilename):
+    """ Return the license name indicated by a file name, the suffix of the file name and whether "-opt" marks it as optimized """
+    licensefilenameparts = licensefilename.split('/')
+    basename = licensefilenameparts[len(licensefilenameparts) - 1]
+    suffix = os.path.splitext(licensefilename)[1]
+    licensename = basename.replace(suffix, '')
+    optimized = licensename.endswith('-opt')
+    if optimized:
+        licensename = licensename[:-4]
+    if licensename.endswith('.unified'):
+        licensename = licensename[:-8]
+    return licensename.replace('+', '|'), suffix, optimized
+
+def convertlicenses(licensefilenames, addobligations, json, args, parsecache, mergecache, sources = None, unifyrules = None, sink = None):
+    """ Parse OSLOC files, convert them to JSON objects and merge them as specified, return the JSON data and, if merged, the merged license with license references
+
+        The content of files found in the dict sources is not read from file. If the licenses are not merged and sink is
+        given, every license is expanded and optimized as specified and passed to sink(licensename, data) as soon as it is
+        converted, and the licenses are not returned. """
     devel = args.devel
     expand = args.expand
     merge = args.merge
     optimize = args.optimize
     licenseupgrade = args.licenseupgrade
-    recreate = args.recreate
-    show = args.show
     unify = args.unify
     verbose = args.verbose
     if args.v1:
@@ -616,75 +2089,42 @@ def osloc2json(licensefilenames, outfilename, json, args):
     else:
         version = 2
 
-    addobligations = {}
-
-    if licenseupgrade:
-        rulesfilename = 'licenseupgraderules.json'
-        try:
-            rulesfile = open(rulesfilename, 'r')
-        except:
-            try:
-                rulesfile = open('../' + rulesfilename, 'r')
-            except:
-                print('Upgrade rules file %r not found or not accessible in current or in parent directory' % rulesfilename)
-        try:
-            x = rulesfile
-        except NameError:
-            pass
-        else:
-            try:
-                rules = json.load(rulesfile)
-            except json.decoder.JSONDecodeError as e:
-                print(e)
-                print('Upgrade rules file %r has no valid JSON format, skipped step attempting to upgrade licenses' % rulesfilename)
-            else:
-                for license in licensefilenames.copy():
-                    for oldlicense, value in rules.items():
-                        if license.find(oldlicense) != -1:
-                            newlicense = license.replace(oldlicense, value[0])
-                            licensefilenames.remove(license)
-                            if newlicense not in licensefilenames:
-                                licensefilenames.append(newlicense)
-                            addobligations[value[0]] = value[1].split(',')
-                licensefilenames = sorted(licensefilenames, key = lambda s: s.lower())
-            rulesfile.close()
-
     licenses = len(licensefilenames)
-
-    if licenses == 1:
-        suffix = os.path.splitext(licensefilenames[0])[1]
-        if optimize:
-            optsuffix = '-opt'
-        else:
-            optsuffix = ''
-        outfilename = licensefilenames[0].replace(suffix, '') + optsuffix + '.json'
+    newrefs = None
+    if merge and licenses > 1:
+        sink = None
+    if sink is not None:
+        for licensefilename in licensefilenames:
+            if splitlicensefilename(licensefilename)[2]:
+                optimize = True
 
     jsondata = {}
 
     globaleitherchains = {}
     globaleitherifchains = {}
+    parsedoptimized = set()
     for licensefilename in licensefilenames:
-        licensefilenameparts = licensefilename.split('/')
-        basename = licensefilenameparts[len(licensefilenameparts) - 1]
-        suffix = os.path.splitext(licensefilename)[1]
-        licensename = basename.replace(suffix, '')
-        if licensename.endswith('-opt'):
-            licensename = licensename[:-4]
+        licensename, suffix, optimized = splitlicensefilename(licensefilename)
+        if optimized:
             optimize = True
-        if licensename.endswith('.unified'):
-            licensename = licensename[:-8]
-        licensename = licensename.replace('+', '|')
+        upgrade = None
+        if licenseupgrade:
+            upgrade = addobligations.get(licensename)
         if verbose:
             print(licensename + ':')
         lineno = 0
         try:
-            oslocfile = open(licensefilename, 'r')
+            if sources is not None and licensefilename in sources:
+                oslocfile = io.StringIO(sources[licensefilename])
+            else:
+                oslocfile = open(licensefilename, 'r')
         except:
             print('File %r not found' % licensefilename)
             sys.exit(1)
         if suffix == '.json':
             try:
-                data = json.load(oslocfile)
+                with Phase('parse'):
+                    data = json.load(oslocfile)
             except json.decoder.JSONDecodeError as e:
                 print(e)
                 print('File %r has no valid JSON format, exiting' % licensefilename)
@@ -702,398 +2142,1246 @@ def osloc2json(licensefilenames, outfilename, json, args):
                     print('Duplicate license name %r found, skipping' % jsonlicensename)
                     continue
                 jsondata[jsonlicensename] = data[jsonlicensename]
+            if upgrade:
+                with Phase('upgrade'):
+                    upgradelicense(data[jsonlicensename], upgrade)
         else:
             if licensename in jsondata:
                 print('Duplicate license name %r found, skipping' % licensename)
                 continue
-            osloc = oslocfile.read()
-            oslocfile.close()
             jsondata[licensename] = {}
             data = jsondata[licensename]
-            orlevels = {}
-            eitherextratabs = 0
-            oriflevels = {}
-            eitherifextratabs = 0
-            parents = {}
-            while True:
-                endlinepos = osloc.find('\n')
-                if endlinepos == 0:
-                    osloc = osloc[endlinepos + 1:]
-                    if len(osloc) == 0:
-                        break
-                    continue
-                line = osloc[0:endlinepos]
-                lineno += 1
-                if line.startswith(' '):
-                    print('Syntax error (leading space) detected in license %r at line %d, output will be incomplete' % (licensename, lineno))
-                    lineno = -1
-                    break
-                line = re.sub(r' \(.*\)', '', line)
-                if verbose:
-                    print(line)
-                tabs = line.count('\t')
-                if devel:
-                    print(tabs, orlevels)
-                tag = ''
-                text = ''
-                if line[0:8] == 'USE CASE':
-                    tag = line[0:8]
-                    text = line[9:]
-                    if tag not in data:
-                        data[tag] = {}
-                    parents[tabs + 1] = data[tag][text] = {}
-                    if devel:
-                        print(data[tag])
-                    tag = ''
-                    eitherextratabs = 0
-                elif re.match('\t*YOU MUST NOT', line):
-                    tag = 'YOU MUST NOT'
-                elif re.match('\t*YOU MUST', line):
-                    tag = 'YOU MUST'
-                elif re.match('\t*ATTRIBUTE', line):
-                    tag = 'ATTRIBUTE'
-                elif re.match('\t*IF', line):
-                    tag = 'IF'
-                elif re.match('\t*EXCEPT IF', line):
-                    tag = 'EXCEPT IF'
-                elif re.match('\t*EITHER IF', line):
-                    tag = 'EITHER IF'
-                elif re.match('\t*OR IF', line):
-                    tag = 'OR IF'
-                elif re.match('\t*EITHER', line):
-                    tag = 'EITHER'
-                elif re.match('\t*OR', line):
-                    tag = 'OR'
-                elif line[0:12] == 'PATENT HINTS':
-                    tag = line[0:12]
-                elif line[0:15] == 'COPYLEFT CLAUSE':
-                    tag = line[0:15]
-                elif line[0:13] == 'COMPATIBILITY':
-                    tag = line[0:13]
-                elif line[0:23] == 'DEPENDING COMPATIBILITY':
-                    tag = line[0:23]
-                elif line[0:15] == 'INCOMPATIBILITY':
-                    tag = line[0:15]
-                else:
-                    print('Unidentified or erroneously positioned language element in license %r at line %d' % (licensename, lineno))
-                    if not verbose:
-                        print(line)
-                    lineno = -1
-                    break
-                if tag != '':
-                    if text == '':
-                        text = line[line.find(tag) + len(tag) + 1:]
-                    if tabs == 0 and (text == 'Yes' or text == 'No' or text == 'Questionable' or tag.find('COMPATIBILITY') != -1):
-                        if tag not in data:
-                            data[tag] = text
-                            if devel:
-                                print(data[tag])
-                        else:
-                            if isinstance(data[tag], str):
-                                oldtext = data[tag]
-                                data[tag] = []
-                                data[tag].append(oldtext)
-                            data[tag].append(text)
-                            if devel:
-                                print(data[tag])
-                    else:
-                        if len(parents) == 0 or (tabs == 0 and tag != 'USE CASE'):
-                            print('Syntax error (illegal position of tag %r), detected in license %r at line %d, output will be incomplete' % (tag, licensename, lineno))
-                            lineno = -1
-                            break
-
-                        if tag == 'EITHER':
-                            totalchain = getchain(data, tabs, '') + '.' + tag
-                            if totalchain not in globaleitherchains:
-                                globaleitherchains[totalchain] = 1
-                            else:
-                                globaleitherchains[totalchain] += 1
-                            text = str(globaleitherchains[totalchain])
-                            for k in orlevels.copy():
-                                if tabs <= k:
-                                    orlevels.pop(k)
-                                    if eitherextratabs > 0:
-                                        eitherextratabs -= 1
-                            orlevels[tabs] = 0
-                        if tag == 'OR':
-                            if tabs not in orlevels:
-                                print('Syntax error (OR before EITHER) detected in license %r at line %d, output will be incomplete' % (licensename, lineno))
-                                lineno = -1
-                                break
-                            orlevels[tabs] += 1
-                            text = str(orlevels[tabs])
-                            if orlevels[tabs] == 1:
-                                eitherextratabs += 1
-                        if tag != 'EITHER':
-                            if len(orlevels) > 0:
-                                for k in orlevels.copy():
-                                    if (tag == 'OR' and tabs < k) or (tag != 'OR' and tabs <= k):
-                                        orlevels.pop(k)
-                                        if eitherextratabs > 0:
-                                            eitherextratabs -= 1
-
-                        if version > 1:
-                            if tag == 'EITHER IF':
-                                eitheroriftext = text
-                                totalchain = getchain(data, tabs, '') + '.' + tag
-                                if totalchain in globaleitherifchains:
-                                    globaleitherifchains[totalchain] += 1
-                                else:
-                                    globaleitherifchains[totalchain] = 1
-                                text = str(globaleitherifchains[totalchain])
-                                for k in oriflevels.copy():
-                                    if tabs <= k:
-                                        oriflevels.pop(k)
-                                        if eitherifextratabs > 0:
-                                            eitherifextratabs -= 1
-                                oriflevels[tabs] = 0
-                            if tag == 'OR IF':
-                                eitheroriftext = text
-                                if tabs not in oriflevels:
-                                    print('Syntax error (OR IF before EITHER IF) detected in license %r at line %d, output will be incomplete' % (licensename, lineno))
-                                    lineno = -1
-                                    break
-                                oriflevels[tabs] += 1
-                                text = str(oriflevels[tabs])
-                                if oriflevels[tabs] == 1:
-                                    eitherifextratabs += 1
-                            if tag != 'EITHER IF':
-                                if len(oriflevels) > 0:
-                                    for k in oriflevels.copy():
-                                        if (tag == 'OR IF' and tabs < k) or (tag != 'OR IF' and tabs <= k):
-                                            oriflevels.pop(k)
-                                            if eitherifextratabs > 0:
-                                                eitherifextratabs -= 1
-
-                        if tabs + eitherextratabs + eitherifextratabs in parents:
-                            if tag not in parents[tabs + eitherextratabs + eitherifextratabs]:
-                                parents[tabs + eitherextratabs + eitherifextratabs][tag] = {}
-                            parents[tabs + eitherextratabs + eitherifextratabs + 1] = parents[tabs + eitherextratabs + eitherifextratabs][tag][text] = {}
-                            if devel:
-                                print(parents[tabs + eitherextratabs + eitherifextratabs][tag])
-
-                        if version > 1:
-                            if tag in ['EITHER IF', 'OR IF']:
-                                parents[tabs + eitherextratabs + eitherifextratabs + 1] = parents[tabs + eitherextratabs + eitherifextratabs][tag][text][eitheroriftext] = {}
-                                if devel:
-                                    print(parents[tabs + eitherextratabs + eitherifextratabs][tag][text])
-
-                osloc = osloc[endlinepos + 1:]
-                if len(osloc) == 0:
-                    break
+            parseoptimize = optimize and not expand and not upgrade
+            with Phase('parse'):
+                lineno = parseoslocfile(oslocfile, licensename, data, globaleitherchains, globaleitherifchains, version, devel, verbose, parsecache, upgrade, parseoptimize)
+            oslocfile.close()
+            if parseoptimize and lineno >= 0:
+                parsedoptimized.add(licensename)
 
-        if lineno == -1:
-            continue
-        if licenseupgrade and len(addobligations) > 0:
-            for newlicense, obligations in addobligations.items():
-                for obligation in obligations:
-                    if newlicense != licensename or obligation.find('YOU MUST ') == -1:
-                        continue
-                    for usecase in data['USE CASE']:
-                        obligation = obligation.replace('YOU MUST ', '')
-                        if 'YOU MUST' not in data['USE CASE'][usecase]:
-                            data['USE CASE'][usecase]['YOU MUST'] = {}
-                        if obligation not in data['USE CASE'][usecase]['YOU MUST']:
-                            data['USE CASE'][usecase]['YOU MUST'][obligation] = {}
+        if sink is not None:
+            if suffix == '.json':
+                name = jsonlicensename
+            else:
+                name = licensename
+            license = {name: jsondata[name]}
+            if expand:
+                with Phase('expand'):
+                    expandor(license, name)
+            if optimize:
+                with Phase('optimize'):
+                    optlicenses(license, parsedoptimized)
+            with Phase('serialize'):
+                sink(name, license[name])
+            jsondata[name] = None
+
+    if sink is not None:
+        return None, None
 
     if expand:
-        expandor(jsondata, licensename)
+        with Phase('expand'):
+            expandor(jsondata, licensename)
 
     if optimize:
-        optjson(jsondata)
+        with Phase('optimize'):
+            optlicenses(jsondata, parsedoptimized)
 
     if licenses > 1:
         alljsondata = {}
         if merge:
-            allrefs = {}
-            copyleft_licenses = []
-            mergednames = ''
-            compatibilities = {}
-            depending_compatibilities = {}
-            for licensename in jsondata:
-                licensedata = {}
-                deepcopy(licensedata, jsondata[licensename])
-                if 'USE CASE' in licensedata:
-                    chain = ['USE CASE']
-                    if isemptyusecase(chain, licensedata['USE CASE']):
-                        Nonetext = 'Not do anything else'
-                        if isinstance(licensedata['USE CASE'], list):
-                            oldlist = licensedata['USE CASE']
-                            licensedata['USE CASE'] = {}
-                            for usecase in oldlist:
-                                licensedata['USE CASE'][usecase] = {}
-                                licensedata['USE CASE'][usecase]['YOU MUST'] = Nonetext
-                        elif isinstance(licensedata['USE CASE'], dict):
-                            for usecase in licensedata['USE CASE']:
-                                if licensedata['USE CASE'][usecase] == {}:
-                                    licensedata['USE CASE'][usecase]['YOU MUST'] = Nonetext
-                if 'COMPATIBILITY' in licensedata:
-                    if isinstance(licensedata['COMPATIBILITY'], str):
-                        all = [licensedata['COMPATIBILITY']]
-                    elif isinstance(licensedata['COMPATIBILITY'], list):
-                        all = licensedata['COMPATIBILITY']
-                    for compatibility in all:
-                        if compatibility not in compatibilities:
-                            compatibilities[compatibility] = 1
-                        else:
-                            compatibilities[compatibility] += 1
-                if 'DEPENDING COMPATIBILITY' in licensedata:
-                    if isinstance(licensedata['DEPENDING COMPATIBILITY'], str):
-                        all = [licensedata['DEPENDING COMPATIBILITY']]
-                    elif isinstance(licensedata['DEPENDING COMPATIBILITY'], list):
-                        all = licensedata['DEPENDING COMPATIBILITY']
-                    for compatibility in all:
-                        if compatibility not in depending_compatibilities:
-                            depending_compatibilities[compatibility] = 1
-                        else:
-                            depending_compatibilities[compatibility] += 1
-                if 'COPYLEFT CLAUSE' not in licensedata:
-                    licensedata['COPYLEFT CLAUSE'] = 'No'
+            mergednames, new, newrefs = mergejsondata(jsondata, unify, optimize, verbose, json, mergecache, unifyrules)
+            alljsondata[mergednames] = new
+        else:
+            alljsondata['OSADL OSLOC'] = jsondata
+        jsondata = alljsondata
+
+    return jsondata, newrefs
+
+def parseworker(task):
+    """ Parse an OSLOC file with a chain log in a worker process, return the key of the parse memo, the parsed license
+        and the chain log, or None, if the file cannot be parsed """
+    licensefilename, licensename, version, upgrade, cachedir, cachesize = task
+    try:
+        oslocfile = open(licensefilename, 'r')
+        osloc = oslocfile.read()
+        oslocfile.close()
+    except:
+        return None
+    cached = None
+    if cachedir is not None:
+        parsecache = ParseCache(cachedir, cachesize)
+        key = parsecache.key(osloc, version, upgrade, True)
+        cached = parsecache.getrelative(key)
+    if cached is not None:
+        data, chainlog = cached
+    else:
+        data = {}
+        chainlog = []
+        try:
+            parseosloc(io.StringIO(osloc), licensename, data, {}, {}, version, False, False, chainlog)
+        except OSLOCSyntaxError:
+            return None
+        if upgrade:
+            upgradelicense(data, upgrade)
+        if cachedir is not None:
+            parsecache.putrelative(key, data, chainlog)
+    return parsekey(osloc, version, upgrade), data, chainlog
+
+def parseinparallel(licensefilenames, addobligations, args, jobs):
+    """ Parse the OSLOC files in jobs processes and return a parse memo with the results
+
+        Every file is parsed with a chain log, and its chains are numbered by the chain counters, when the licenses are
+        converted in order. Files with syntax errors are not stored, so that their errors are reported in order. """
+    import multiprocessing
+
+    if args.v1:
+        version = 1
+    else:
+        version = 2
+    if args.nocache:
+        cachedir = None
+    else:
+        cachedir = args.cachedir
+    tasks = []
+    for licensefilename in licensefilenames:
+        licensename, suffix, optimized = splitlicensefilename(licensefilename)
+        if suffix == '.json':
+            continue
+        upgrade = None
+        if args.licenseupgrade:
+            upgrade = addobligations.get(licensename)
+        tasks.append((licensefilename, licensename, version, upgrade, cachedir, args.cachesize * 1024 * 1024))
+    parsememo = ParseMemo()
+    if len(tasks) < 2:
+        return parsememo
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    for result in pool.imap_unordered(parseworker, tasks):
+        if result is not None:
+            key, data, chainlog = result
+            parsememo.putrelative(key, data, chainlog)
+    pool.close()
+    pool.join()
+    return parsememo
+
+def dumpjson(data, format = 'indent'):
+    """ Return JSON data serialized with sorted keys, indented by 4 spaces or, if format is "compact" or "jsonl", without any
+        whitespace, in which case orjson is used, if installed """
+    if format == 'indent':
+        return json.dumps(data, indent = 4, sort_keys = True)
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option = orjson.OPT_SORT_KEYS).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(data, sort_keys = True, separators = (',', ':'), ensure_ascii = False)
+
+class JSONWriter:
+    """ Write the JSON output of a conversion license by license, as the licenses are finished
+
+        In "jsonl" format, every license is written immediately as a single line. In "indent" and "compact" format,
+        every license is serialized immediately, and the licenses are written in sorted order, so that the output is
+        the same as that of serializing all licenses together. If the names of the licenses are given in advance,
+        a license is written as soon as all licenses sorted before it are written, and only the licenses that are
+        finished before a license sorted before them are kept; a name not known in advance is given as None, and
+        no license is written before the licenses of all such names are finished. Otherwise, the licenses are kept
+        until the writer is closed. If wrapped, the licenses are written as members of "OSADL OSLOC" unless in
+        "jsonl" format. Output files with the suffix ".gz", ".xz" or ".lzma" are compressed accordingly. With show,
+        the output is also written to standard output. With a validator, every license is validated against the
+        OSLOC schema before it is serialized, and the failures are printed and counted. """
+
+    formats = ['indent', 'compact', 'jsonl']
+
+    def __init__(self, filename, format = 'indent', wrapped = False, show = False, validator = None, names = None):
+        self.filename = str(filename)
+        self.format = format
+        self.wrapped = wrapped
+        self.show = show
+        self.validator = validator
+        self.failures = 0
+        self.fragments = {}
+        self.members = 0
+        self.pending = None
+        if names is not None:
+            self.pending = sorted(set(name for name in names if name is not None))
+            self.unknown = names.count(None)
+        self.nextpending = 0
+        self.outfile = None
+        if format == 'indent':
+            self.indent = '\n' + ' ' * 4 * (1 + wrapped)
+            self.separator = ': '
+        else:
+            self.indent = ''
+            self.separator = ':'
+
+    def open(self):
+        """ Open the output file, which is not done before the first output, so that an existing file is kept, if the conversion fails """
+        if self.filename.endswith('.gz'):
+            import gzip
+            self.outfile = gzip.open(self.filename, 'wt', encoding = 'utf-8')
+        elif self.filename.endswith('.xz') or self.filename.endswith('.lzma'):
+            import lzma
+            if self.filename.endswith('.xz'):
+                lzmaformat = lzma.FORMAT_XZ
+            else:
+                lzmaformat = lzma.FORMAT_ALONE
+            self.outfile = lzma.open(self.filename, 'wt', encoding = 'utf-8', format = lzmaformat)
+        elif self.format == 'indent':
+            self.outfile = open(self.filename, 'w')
+        else:
+            self.outfile = open(self.filename, 'w', encoding = 'utf-8')
+
+    def write(self, text):
+        if self.outfile is None:
+            self.open()
+        self.outfile.write(text)
+        if self.show:
+            sys.stdout.write(text)
+
+    def add(self, licensename, data):
+        """ Serialize a finished license and write it, if it is next in "jsonl" format or in sorted order """
+        if self.validator is not None:
+            message = validatelicense(licensename, data, self.validator)
+            if message is not None:
+                print(message)
+                self.failures += 1
+        if self.format == 'jsonl':
+            self.write(dumpjson({licensename: data}, self.format) + '\n')
+            return
+        fragment = dumpjson(data, self.format)
+        if self.format == 'indent':
+            fragment = fragment.replace('\n', self.indent)
+        self.fragments[licensename] = fragment
+        if self.pending is None:
+            return
+        index = bisect.bisect_left(self.pending, licensename, self.nextpending)
+        if index == len(self.pending) or self.pending[index] != licensename:
+            self.pending.insert(index, licensename)
+            self.unknown -= 1
+        if self.unknown == 0:
+            while self.nextpending < len(self.pending) and self.pending[self.nextpending] in self.fragments:
+                self.writemember(self.pending[self.nextpending])
+                self.nextpending += 1
+
+    def writemember(self, licensename):
+        """ Write a serialized license as next member of the output """
+        if self.members == 0:
+            if self.wrapped:
+                if self.format == 'indent':
+                    self.write('{\n    "OSADL OSLOC": ')
                 else:
-                    copyleft_licenses.append(licensename)
-                if 'PATENT HINTS' not in licensedata:
-                    licensedata['PATENT HINTS'] = 'No'
-                if mergednames == '':
-                    mergednames = licensename
-                    new = licensedata
-                    allrefs[licensename] = licensedata
+                    self.write('{"OSADL OSLOC":')
+            self.write('{' + self.indent)
+        else:
+            self.write(',' + self.indent)
+        self.write(json.dumps(licensename) + self.separator + self.fragments.pop(licensename))
+        self.members += 1
+
+    def close(self):
+        """ Write all licenses not written yet and close the output file """
+        if self.format != 'jsonl':
+            for licensename in sorted(self.fragments):
+                self.writemember(licensename)
+            if self.members == 0:
+                text = '{}'
+                if self.wrapped:
+                    if self.format == 'indent':
+                        text = '{\n    "OSADL OSLOC": {}'
+                    else:
+                        text = '{"OSADL OSLOC":{}'
+            else:
+                text = self.indent[:-4] + '}'
+            if self.wrapped:
+                if self.format == 'indent':
+                    text += '\n}'
                 else:
-                    mergednames = mergednames + '|' + licensename
-                    if verbose:
-                        print(mergednames)
-                    allrefs[licensename] = licensedata
-                    new = extend(new, licensedata, devel, [], [], unify)
-
-            copyleft_licenses = sorted(copyleft_licenses, key = lambda s: s.lower())
-
-            new['COMPATIBILITY'] = []
-            for k, v in compatibilities.items():
-                if v == len(copyleft_licenses):
-                    new['COMPATIBILITY'].append(k)
-            if len(new['COMPATIBILITY']) == 0:
-                new.pop('COMPATIBILITY')
-            new['DEPENDING COMPATIBILITY'] = []
-            for k, v in depending_compatibilities.items():
-                if v == len(copyleft_licenses):
-                    new['DEPENDING COMPATIBILITY'].append(k)
-            if len(new['DEPENDING COMPATIBILITY']) == 0:
-                new.pop('DEPENDING COMPATIBILITY')
-
-            licenserefs = {}
-            allflat = flatten(new.copy())
-            for license, refs in allrefs.items():
-                for ref in flatten(refs):
-                    for allref in allflat:
-                        if allref.startswith(ref):
-                            if ref not in licenserefs:
-                                licenserefs[ref] = []
-                            if license not in licenserefs[ref]:
-                                licenserefs[ref].append(license)
-
-            newrefs = {}
-            deepcopy(newrefs, new)
-            addlrefs(newrefs, licenserefs)
-
-            if 'INCOMPATIBILITY' in new or len(copyleft_licenses) > 0:
-                incompatible_licensesrefs = []
-                incompatible_licenses = []
-
-                names = mergednames.split('|')
-                if 'INCOMPATIBILITY' in new:
-                    for license in names:
-                        if license in new['INCOMPATIBILITY']:
-                            for reflicense in newrefs['INCOMPATIBILITY']:
-                                if license == reflicense.split(' | ')[0]:
-                                    incompatible_licensesrefs.append(reflicense)
-                                    incompatible_licenses.append(license)
-
-                for copyleft_license in copyleft_licenses.copy():
-                    if 'COMPATIBILITY' not in new or ('COMPATIBILITY' in new and copyleft_license not in new['COMPATIBILITY']):
-                        incompatible_copyleft_licenses_str = ''
-                        for copyleft_license2 in copyleft_licenses.copy():
-                            if copyleft_license2 == copyleft_license:
-                                continue
-                            if 'COMPATIBILITY' in jsondata[copyleft_license2] and copyleft_license in jsondata[copyleft_license2]['COMPATIBILITY']:
-                                continue
-                            if incompatible_copyleft_licenses_str != '':
-                                incompatible_copyleft_licenses_str += ', '
-                            incompatible_copyleft_licenses_str += copyleft_license2
-                        if incompatible_copyleft_licenses_str != '':
-                            incompatible_licensesrefs.append(copyleft_license + ' | If licensed under ' + incompatible_copyleft_licenses_str)
-                            if copyleft_license not in incompatible_licenses:
-                                incompatible_licenses.append(copyleft_license)
-                if len(incompatible_licenses) > 0:
-                    incompatible_licenses = sorted(incompatible_licenses, key = lambda s: s.lower())
-                    new['INCOMPATIBLE LICENSES'] = incompatible_licenses
-                    newrefs['INCOMPATIBLE LICENSES'] = incompatible_licensesrefs
-
-            if 'INCOMPATIBLE LICENSES' not in new or ('INCOMPATIBLE LICENSES' in new and not commonlistitem(copyleft_licenses, new['INCOMPATIBLE LICENSES'])):
-                for copyleft_license in copyleft_licenses:
-                    if 'COMPATIBILITY' not in new or ('COMPATIBILITY' in new and copyleft_license not in new['COMPATIBILITY']):
-                        ref = ' | ' + copyleft_license + ' (only copyleft license)'
-                        if 'COMPATIBILITY' not in new:
-                            new['COMPATIBILITY'] = [copyleft_license]
-                            newrefs['COMPATIBILITY'] = [copyleft_license + ref]
-                        elif isinstance(new['COMPATIBILITY'], str):
-                            new['COMPATIBILITY'] = [new['COMPATIBILITY'], copyleft_license]
-                            newrefs['COMPATIBILITY'] = [newrefs['COMPATIBILITY'], copyleft_license + ref]
-                        else:
-                            new['COMPATIBILITY'].append(copyleft_license)
-                            newrefs['COMPATIBILITY'].append(copyleft_license + ref)
-                        new['COMPATIBILITY'] = sorted(new['COMPATIBILITY'], key = lambda s: s.lower())
-                        newrefs['COMPATIBILITY'] = sorted(newrefs['COMPATIBILITY'], key = lambda s: s.lower())
+                    text += '}'
+            self.write(text + '\n')
+        if self.outfile is None:
+            self.open()
+        self.outfile.close()
 
-            if unify:
-                rulesfilename = 'unifyrules.json'
-                try:
-                    rulesfile = open(rulesfilename, 'r')
-                except:
-                    try:
-                        rulesfile = open('../' + rulesfilename, 'r')
-                    except:
-                        print('Unify rules file %r not found or not accessible in current or in parent directory' % rulesfilename)
-                try:
-                    rules = json.load(rulesfile)
-                    rulesfile.close()
-                except:
-                    print('Cannot unify')
-                else:
-                    unifylicenses(newrefs, rules)
-                    unifylicenses(new, rules)
+def osloc2json(licensefilenames, outfilename, json, args):
+    """ Open OSLOC files, convert them to JSON objects and store them as specified """
+    merge = args.merge
+    optimize = args.optimize
+    recreate = args.recreate
+    show = args.show
+    if args.v1:
+        version = 1
+    else:
+        version = 2
 
-            if optimize:
-                optjson(new)
+    if args.nocache or args.devel or args.verbose:
+        parsecache = None
+        mergecache = None
+    else:
+        parsecache = ParseCache(args.cachedir, args.cachesize * 1024 * 1024)
+        mergecache = MergeCache(args.cachedir, args.cachesize * 1024 * 1024)
 
-            uniq(new)
-            uniq(newrefs)
+    addobligations = {}
+    if args.licenseupgrade:
+        licensefilenames, addobligations = upgradelicensefilenames(licensefilenames, json)
 
-            if len(copyleft_licenses) > 0:
-                new['COPYLEFT LICENSES'] = copyleft_licenses
+    licenses = len(licensefilenames)
+    runstats = currentstats.get()
+    if runstats is not None:
+        runstats.licenses = [splitlicensefilename(licensefilename)[0] for licensefilename in licensefilenames]
 
-            alljsondata[mergednames] = new
+    if licenses == 1:
+        suffix = os.path.splitext(licensefilenames[0])[1]
+        if optimize:
+            optsuffix = '-opt'
         else:
-            alljsondata['OSADL OSLOC'] = jsondata
-        jsondata = alljsondata
+            optsuffix = ''
+        outfilename = licensefilenames[0].replace(suffix, '') + optsuffix + '.json'
 
+    jobs = args.jobs
+    if jobs == 0:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+    if jobs is not None and jobs > 1 and licenses > 1 and not (args.devel or args.verbose):
+        with Phase('preparse'):
+            parsecache = parseinparallel(licensefilenames, addobligations, args, jobs)
+
+    validator = None
+    if args.validateoutput:
+        validator = mkvalidator(loadvalidator(args))
+
+    names = None
+    if not recreate and not (merge and licenses > 1):
+        names = []
+        for licensefilename in licensefilenames:
+            licensename, suffix, optimized = splitlicensefilename(licensefilename)
+            if suffix == '.json':
+                names.append(None)
+            else:
+                names.append(licensename)
+    writer = JSONWriter(outfilename, args.format, licenses > 1 and not merge, show, validator, names)
     if recreate:
-        l = {}
-        if merge and licenses > 1:
-            deepcopy(l, newrefs)
+        jsondata, newrefs = convertlicenses(licensefilenames, addobligations, json, args, parsecache, mergecache)
+    else:
+        jsondata, newrefs = convertlicenses(licensefilenames, addobligations, json, args, parsecache, mergecache, sink = writer.add)
+
+    if recreate:
+        with Phase('render'):
+            if args.checklistdir is not None:
+                os.makedirs(args.checklistdir, exist_ok = True)
+                if merge and licenses > 1:
+                    checklists = {list(jsondata.keys())[0]: newrefs}
+                elif licenses > 1:
+                    checklists = jsondata['OSADL OSLOC']
+                else:
+                    checklists = jsondata
+                for licensename, l in checklists.items():
+                    writechecklist(args.checklistdir, licensename, l, version, args.checklistformat)
+            else:
+                title = None
+                if merge and licenses > 1:
+                    l = newrefs
+                    title = list(jsondata.keys())[0].replace('|', '+')
+                else:
+                    l = jsondata
+                    if len(jsondata.keys()) == 1:
+                        title = list(jsondata.keys())[0]
+                        l = l[title]
+                sys.stdout.write(renderchecklist(l, version, args.checklistformat, title))
+
+    with Phase('serialize'):
+        if jsondata is not None:
+            if writer.wrapped:
+                jsondata = jsondata['OSADL OSLOC']
+            for licensename, data in jsondata.items():
+                writer.add(licensename, data)
+        writer.close()
+    return writer.failures == 0
+
+def parsechecklist(text, licensename = '', version = 2, eitherchains = None, eitherifchains = None):
+    """ Parse the text of an OSLOC checklist and return it as JSON object, raise OSLOCSyntaxError in case of a syntax error
+
+        EITHER and EITHER IF chains are numbered from 1, unless the counters of a previous call are given in eitherchains
+        and eitherifchains, as the conversion of several OSLOC files does. """
+    if eitherchains is None:
+        eitherchains = {}
+    if eitherifchains is None:
+        eitherifchains = {}
+    data = {}
+    parseosloc(io.StringIO(text), licensename, data, eitherchains, eitherifchains, version, False, False)
+    return data
+
+def mergelicensedata(licenses, unify = False, unifyrules = None, optimize = False):
+    """ Merge licenses given as dict of license names and JSON objects as option -m does, return the merged license names
+        joined by "|", the merged license and the merged license with license references, as used to recreate the checklist """
+    if len(licenses) < 2:
+        raise OSLOCError('At least two licenses are needed to merge, %d given' % len(licenses))
+    if unify and unifyrules is None:
+        raise OSLOCError('Unify rules are needed to unify licenses')
+    jsondata = licenses
+    if optimize:
+        jsondata = clonejson(licenses)
+        optjson(jsondata)
+    return mergejsondata(jsondata, unify, optimize, False, json, None, unifyrules)
+
+def unifylicensedata(license, unifyrules):
+    """ Return a copy of a license with semantically similar obligations unified according to the unify rules """
+    license = clonejson(license)
+    unifylicenses(license, unifyrules)
+    return license
+
+def optimizelicensedata(license):
+    """ Return a copy of a license optimized as option -o does """
+    jsondata = {'': clonejson(license)}
+    optjson(jsondata)
+    return jsondata['']
+
+checklistformats = {'checklist': '.checklist', 'markdown': '.md', 'html': '.html'}
+
+markdownpattern = re.compile(r'[\\`*_\[\]<>#]')
+
+def checklistitems(text):
+    """ Return the nesting levels and the texts of the non-empty lines of an OSLOC checklist
+
+        The level of a line is one deeper than that of the preceding line that is indented less, so that lines indented
+        by more than one tab more than their parent are nested only one level deeper. """
+    items = []
+    indents = []
+    for line in text.split('\n'):
+        item = line.strip()
+        if item == '':
+            continue
+        indent = len(line) - len(line.lstrip('\t'))
+        while len(indents) > 0 and indents[-1] > indent:
+            indents.pop()
+        if len(indents) == 0 or indents[-1] < indent:
+            indents.append(indent)
+        items.append((len(indents) - 1, item))
+    return items
+
+def checklist2markdown(text, title = None):
+    """ Return the text of an OSLOC checklist as nested Markdown list, headed by the title, if given """
+    lines = []
+    if title is not None:
+        lines += ['# ' + markdownpattern.sub(r'\\\g<0>', title), '']
+    for level, item in checklistitems(text):
+        lines.append('  ' * level + '- ' + markdownpattern.sub(r'\\\g<0>', item))
+    return '\n'.join(lines) + '\n'
+
+def checklist2html(text, title = None):
+    """ Return the text of an OSLOC checklist as HTML document with nested unordered lists, headed by the title, if given """
+    import html
+
+    lines = ['<!DOCTYPE html>', '<html>', '<head>', '<meta charset="utf-8">']
+    if title is not None:
+        lines.append('<title>' + html.escape(title) + '</title>')
+    lines += ['</head>', '<body>']
+    if title is not None:
+        lines.append('<h1>' + html.escape(title) + '</h1>')
+    level = -1
+    for itemlevel, item in checklistitems(text):
+        if itemlevel > level:
+            lines.append('  ' * itemlevel + '<ul>')
+            level = itemlevel
+        else:
+            lines.append('  ' * level + '</li>')
+            while level > itemlevel:
+                level -= 1
+                lines.append('  ' * level + '</ul>')
+                lines.append('  ' * level + '</li>')
+        lines.append('  ' * level + '<li>' + html.escape(item))
+    while level >= 0:
+        lines.append('  ' * level + '</li>')
+        lines.append('  ' * level + '</ul>')
+        level -= 1
+    lines += ['</body>', '</html>']
+    return '\n'.join(lines) + '\n'
+
+def renderchecklist(license, version = 2, format = 'checklist', title = None):
+    """ Return a license given as JSON object as text of an OSLOC checklist, or in "markdown" or "html" format as nested
+        list headed by the title, if given
+
+        The checklist is written into a buffer in a single walk through the license, and the other formats are made
+        from its lines. """
+    checklist = io.StringIO()
+    back2osloc(license, 0, '', {}, {}, '', {}, 0, version, checklist)
+    checklist.write('\n')
+    if format == 'markdown':
+        return checklist2markdown(checklist.getvalue(), title)
+    if format == 'html':
+        return checklist2html(checklist.getvalue(), title)
+    return checklist.getvalue()
+
+def writechecklist(checklistdir, licensename, license, version = 2, format = 'checklist'):
+    """ Write a license given as JSON object as checklist in the given format to a file in checklistdir named after the
+        license, the names of merged licenses joined by "+", with the suffix of the format, return the file name """
+    licensename = licensename.replace('|', '+')
+    checklistfilename = os.path.join(checklistdir, licensename + checklistformats[format])
+    checklistfile = open(checklistfilename, 'w')
+    checklistfile.write(renderchecklist(license, version, format, licensename))
+    checklistfile.close()
+    return checklistfilename
+
+class LicenseIndex:
+    """ Inverted index of a license corpus that maps use cases, tag paths and terms to the sets of licenses that have them
+
+        Every term of a license is recorded with the use case it applies to, "" outside of USE CASE, and the path of
+        the tags above it within the use case, joined by "/" and without the numbers of EITHER and EITHER IF chains,
+        e.g. ("Binary delivery", "EITHER/YOU MUST", "Provide Source code"). Use cases joined by OR are recorded
+        separately, and the use cases themselves are recorded as terms of the path "USE CASE". The sets of the
+        licenses of a path and term in any use case, of a use case and path with any term and of a path alone are
+        kept as well, so that every lookup is a single dict access. """
+
+    def __init__(self):
+        self.licenses = set()
+        self.entries = {}
+        self.byterm = {}
+        self.byusecase = {}
+        self.bypath = {}
+
+    def addentry(self, usecase, path, term, licensenames):
+        """ Record that the licenses have a term below a tag path in a use case """
+        for index, key in [(self.entries, (usecase, path, term)), (self.byterm, (path, term)), (self.byusecase, (usecase, path)),
+          (self.bypath, path)]:
+            licenses = index.get(key)
+            if licenses is None:
+                licenses = index[key] = set()
+            licenses.update(licensenames)
+
+    def addvalue(self, licensename, usecase, path, v, belowtag):
+        """ Record the terms of a value of a license below a tag path, the keys of which are terms, if it is the value of
+            a tag, and tags otherwise """
+        if isinstance(v, list):
+            for v2 in v:
+                if belowtag and isinstance(v2, dict):
+                    self.addvalue(licensename, usecase, path, v2, path[-1] in ['EITHER IF', 'OR IF'])
+                else:
+                    self.addvalue(licensename, usecase, path, v2, belowtag)
+            return
+        if isinstance(v, str):
+            v = {v: {}}
+        if not isinstance(v, dict):
+            return
+        for k, v2 in v.items():
+            if belowtag and k.isdigit():
+                self.addvalue(licensename, usecase, path, v2, path[-1] in ['EITHER IF', 'OR IF'])
+            elif belowtag and k not in ['OR', 'OR IF']:
+                self.addentry(usecase, '/'.join(path), k, [licensename])
+                self.addvalue(licensename, usecase, path, v2, False)
+            else:
+                self.addvalue(licensename, usecase, path + [k], v2, True)
+
+    def add(self, licensename, license):
+        """ Add the terms of a license given as JSON object to the index """
+        self.licenses.add(licensename)
+        for tag, v in license.items():
+            if tag != 'USE CASE':
+                self.addvalue(licensename, '', [tag], v, True)
+                continue
+            if isinstance(v, str):
+                v = {v: {}}
+            elif isinstance(v, list):
+                v = {k: v2 for v1 in v for k, v2 in ({v1: {}} if isinstance(v1, str) else v1).items()}
+            for usecases, v2 in v.items():
+                for usecase in usecases.split(' OR '):
+                    self.addentry('', 'USE CASE', usecase, [licensename])
+                    self.addvalue(licensename, usecase, [], v2, False)
+
+    def query(self, path, term = None, usecase = None):
+        """ Return the set of the licenses that have the term below the tag path in the use case, any term, if term is
+            None, in any use case, if usecase is None """
+        if usecase is None and term is None:
+            licenses = self.bypath.get(path)
+        elif usecase is None:
+            licenses = self.byterm.get((path, term))
+        elif term is None:
+            licenses = self.byusecase.get((usecase, path))
         else:
-            deepcopy(l, jsondata)
-            if len(jsondata.keys()) == 1:
-                l = l[list(jsondata.keys())[0]]
-        back2osloc(l, 0, '', {}, {}, '', {}, 0, version)
-        print()
+            licenses = self.entries.get((usecase, path, term))
+        if licenses is None:
+            return set()
+        return set(licenses)
+
+    def lookup(self, query):
+        """ Return the set of the licenses that match a query of the form "[USE CASE:]PATH[=TERM]", e.g. "Binary
+            delivery:YOU MUST=Provide Copyright notices" or "COMPATIBILITY=GPL-3.0-only" """
+        usecase = None
+        term = None
+        path = query
+        if '=' in path:
+            path, term = path.split('=', 1)
+        if ':' in path:
+            usecase, path = path.rsplit(':', 1)
+        return self.query(path, term, usecase)
+
+    def save(self, filename):
+        """ Write the index to a file in JSON format """
+        entries = [[usecase, path, term, sorted(licenses)] for (usecase, path, term), licenses in sorted(self.entries.items())]
+        indexfile = open(filename, 'w', encoding = 'utf-8')
+        json.dump({'OSLOC INDEX': {'licenses': sorted(self.licenses), 'entries': entries}}, indexfile, separators = (',', ':'),
+          ensure_ascii = False)
+        indexfile.write('\n')
+        indexfile.close()
+
+    def load(self, filename):
+        """ Add the licenses of an index file written by save() to the index, raise OSLOCError, if it cannot be read """
+        try:
+            indexfile = open(filename, 'r', encoding = 'utf-8')
+            data = json.load(indexfile)
+            indexfile.close()
+            data = data['OSLOC INDEX']
+            self.licenses.update(data['licenses'])
+            for usecase, path, term, licenses in data['entries']:
+                self.addentry(usecase, path, term, licenses)
+        except (OSError, ValueError, KeyError, TypeError):
+            raise OSLOCError('%r is not a license index' % str(filename))
+
+workerstate = {}
+
+def initworker(licensefilenames, args, parsememo, sources = None, unifyrules = None, upgraderules = None):
+    """ Initialize a process that merges licenses for the license matrix or the server """
+    workerstate['licensefilenames'] = licensefilenames
+    workerstate['args'] = args
+    workerstate['parsememo'] = parsememo
+    workerstate['sources'] = sources
+    workerstate['unifyrules'] = unifyrules
+    workerstate['upgraderules'] = upgraderules
+    vocabulary = None
+    if parsememo is not None:
+        vocabulary = parsememo.vocabulary
+    if args.devel or args.verbose:
+        workerstate['mergecache'] = None
+    elif args.nocache or sources is not None:
+        workerstate['mergecache'] = MergeCache(None, 0, vocabulary)
+    else:
+        workerstate['mergecache'] = MergeCache(args.cachedir, args.cachesize * 1024 * 1024, vocabulary)
+
+def preparseupgrades(licensefilenames, json, args, parsememo, upgraderules, sources = None):
+    """ Parse the licenses the given licenses are upgraded to, add their obligations and store them in the parse memo """
+    upgradeargs = copy.copy(args)
+    upgradeargs.merge = False
+    upgradeargs.licenseupgrade = True
+    for licensefilename in licensefilenames:
+        newlicensefilename, upgraded = upgraderules.upgradefilename(licensefilename)
+        if len(upgraded) == 0 or (sources is None and not os.path.isfile(newlicensefilename)) or (sources is not None and newlicensefilename not in sources):
+            continue
+        addobligations = {}
+        for newlicense in upgraded:
+            addobligations[newlicense] = upgraderules.obligations[newlicense]
+        try:
+            convertlicenses([newlicensefilename], addobligations, json, upgradeargs, parsememo, None, sources)
+        except SystemExit:
+            pass
 
+def workerconvert(licensefilenames, args):
+    """ Convert and merge licenses with the state of the worker process, return the JSON data and the merged license with license references """
+    addobligations = {}
+    if args.licenseupgrade:
+        licensefilenames, addobligations = upgradelicensefilenames(licensefilenames, json, workerstate['upgraderules'])
+    return convertlicenses(licensefilenames, addobligations, json, args, workerstate['parsememo'], workerstate['mergecache'],
+      workerstate['sources'], workerstate['unifyrules'])
+
+def mkmatrixline(combination):
+    """ Merge a combination of licenses and return the result as a single line of JSON """
+    licensefilenames = [workerstate['licensefilenames'][i] for i in combination]
+    args = workerstate['args']
+    jsondata, newrefs = workerconvert(licensefilenames, args)
+    if args.recreate and args.checklistdir is not None:
+        if args.v1:
+            version = 1
+        else:
+            version = 2
+        licensename = list(jsondata.keys())[0]
+        if newrefs is None:
+            newrefs = jsondata[licensename]
+        writechecklist(args.checklistdir, licensename, newrefs, version, args.checklistformat)
+    return json.dumps(jsondata, sort_keys = True)
+
+def osloc2jsonmatrix(licensefilenames, outfilename, json, args):
+    """ Merge every combination of args.matrix licenses and store the results as JSON Lines in the order they are completed """
+    if args.devel or args.verbose:
+        parsememo = None
+    else:
+        parsememo = ParseMemo()
+        singleargs = copy.copy(args)
+        singleargs.merge = False
+        for licensefilename in licensefilenames:
+            convertlicenses([licensefilename], {}, json, singleargs, parsememo, None)
+    upgraderules = None
+    if args.licenseupgrade:
+        upgraderules = loadupgraderules(json)
+        if parsememo is not None and upgraderules is not None:
+            preparseupgrades(licensefilenames, json, singleargs, parsememo, upgraderules)
+
+    import multiprocessing
+
+    jobs = args.jobs
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    combinations = itertools.combinations(range(len(licensefilenames)), args.matrix)
+    if args.recreate and args.checklistdir is not None:
+        os.makedirs(args.checklistdir, exist_ok = True)
     jsonfile = open(outfilename, 'w')
-    json.dump(jsondata, jsonfile, indent = 4, sort_keys = True)
-    jsonfile.write('\n')
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, initworker, (licensefilenames, args, parsememo, None, None, upgraderules))
+        lines = pool.imap_unordered(mkmatrixline, combinations, 16)
+    else:
+        pool = None
+        initworker(licensefilenames, args, parsememo, None, None, upgraderules)
+        lines = map(mkmatrixline, combinations)
+    for line in lines:
+        jsonfile.write(line + '\n')
+    if pool is not None:
+        pool.close()
+        pool.join()
     jsonfile.close()
 
-    if show:
-        json.dump(jsondata, sys.stdout, indent = 4, sort_keys = True)
-        sys.stdout.write('\n')
+def osloc2jsonindex(filenames, indexfilename, json, args):
+    """ Parse the OSLOC files, or all ".txt" files of OSLOC directories, index their use cases, tags and terms, write the
+        index to indexfilename and return it
+
+        The licenses are added to the index one after another, as they are converted, so that they need not be held in
+        memory together. """
+    licensefilenames = []
+    for filename in filenames:
+        if os.path.isdir(filename):
+            licensefilenames += sorted(os.path.join(filename, f) for f in os.listdir(filename) if f.endswith('.txt'))
+        else:
+            licensefilenames.append(filename)
+    if args.nocache or args.devel or args.verbose:
+        parsecache = None
+    else:
+        parsecache = ParseCache(args.cachedir, args.cachesize * 1024 * 1024)
+    indexargs = copy.copy(args)
+    indexargs.merge = False
+    index = LicenseIndex()
+    convertlicenses(licensefilenames, {}, json, indexargs, parsecache, None, sink = index.add)
+    index.save(indexfilename)
+    return index
+
+def querylicenses(index, queries):
+    """ Print the licenses of an index that match all queries as list in JSON format """
+    licenses = None
+    for query in queries:
+        if licenses is None:
+            licenses = index.lookup(query)
+        else:
+            licenses &= index.lookup(query)
+    print(json.dumps(sorted(licenses, key = lambda s: s.lower())))
+
+def serverconvert(query, licensefilenames, options):
+    """ Answer a merge, checklist or compatibility request to the server in a worker process, return the content type and the content """
+    args = copy.copy(workerstate['args'])
+    args.merge = True
+    for option in ['expand', 'licenseupgrade', 'optimize', 'unify', 'v1']:
+        setattr(args, option, option in options)
+    addobligations = {}
+    if args.licenseupgrade:
+        licensefilenames, addobligations = upgradelicensefilenames(list(licensefilenames), json, workerstate['upgraderules'])
+        for licensefilename in licensefilenames:
+            if licensefilename not in workerstate['sources']:
+                raise OSLOCError('Upgraded license file %r not available' % licensefilename)
+    try:
+        jsondata, newrefs = convertlicenses(licensefilenames, addobligations, json, args, workerstate['parsememo'], workerstate['mergecache'],
+          workerstate['sources'], workerstate['unifyrules'])
+    except SystemExit:
+        raise OSLOCError('Cannot convert %s' % ', '.join(licensefilenames))
+    if query == 'merge':
+        return 'application/json', json.dumps(jsondata, indent = 4, sort_keys = True) + '\n'
+    license = jsondata[list(jsondata.keys())[0]]
+    if query == 'checklist':
+        if newrefs is not None:
+            license = newrefs
+        if args.v1:
+            version = 1
+        else:
+            version = 2
+        title = list(jsondata.keys())[0].replace('|', '+')
+        if 'markdown' in options:
+            return 'text/markdown; charset=utf-8', renderchecklist(license, version, 'markdown', title)
+        if 'html' in options:
+            return 'text/html; charset=utf-8', renderchecklist(license, version, 'html', title)
+        return 'text/plain; charset=utf-8', renderchecklist(license, version)
+    compatibility = {'LICENSES': list(jsondata.keys())[0]}
+    for key in ['COMPATIBILITY', 'COPYLEFT LICENSES', 'DEPENDING COMPATIBILITY', 'INCOMPATIBILITY', 'INCOMPATIBLE LICENSES']:
+        if key in license:
+            compatibility[key] = license[key]
+    return 'application/json', json.dumps(compatibility, indent = 4, sort_keys = True) + '\n'
+
+def osloc2jsonserve(filenames, json, args):
+    """ Parse OSLOC files and rules once and answer merge, checklist and compatibility requests at localhost port args.serve
+
+        A directory among the file names stands for all ".txt" files in it. The requests are answered by a pool of
+        worker processes; a reload request parses the files and rules again and replaces the pool. A request that
+        is not converted within args.servetimeout seconds is answered with status 504. """
+    import http.server
+    import multiprocessing
+    import signal
+    import threading
+    import urllib.parse
+
+    jobs = args.jobs
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    verbose = args.verbose
+    state = {}
+    lock = threading.Lock()
+
+    def load():
+        """ Read and parse all OSLOC files and load the rules, return the license names with their file names and a new pool """
+        licensefilenames = []
+        for filename in filenames:
+            if os.path.isdir(filename):
+                licensefilenames += sorted(os.path.join(filename, f) for f in os.listdir(filename) if f.endswith('.txt'))
+            else:
+                licensefilenames.append(filename)
+        corpus = {}
+        sources = {}
+        for licensefilename in licensefilenames:
+            licensename = os.path.splitext(os.path.basename(licensefilename))[0]
+            if licensename in corpus:
+                print('Duplicate license name %r found, skipping' % licensename)
+                continue
+            try:
+                oslocfile = open(licensefilename, 'r')
+            except:
+                print('File %r not found' % licensefilename)
+                continue
+            sources[licensefilename] = oslocfile.read()
+            oslocfile.close()
+            corpus[licensename] = licensefilename
+        if args.devel or args.verbose:
+            parsememo = None
+        else:
+            parsememo = ParseMemo()
+            singleargs = copy.copy(args)
+            for option in ['expand', 'licenseupgrade', 'merge', 'optimize', 'unify', 'v1']:
+                setattr(singleargs, option, False)
+            for licensefilename in sources:
+                try:
+                    convertlicenses([licensefilename], {}, json, singleargs, parsememo, None, sources)
+                except SystemExit:
+                    pass
+        unifyrules = loadunifyrules(json)
+        upgraderules = loadupgraderules(json)
+        if parsememo is not None and upgraderules is not None:
+            preparseupgrades(list(sources.keys()), json, singleargs, parsememo, upgraderules, sources)
+        pool = multiprocessing.Pool(jobs, initworker, (list(sources.keys()), args, parsememo, sources, unifyrules, upgraderules))
+        return corpus, pool
+
+    def reload():
+        corpus, pool = load()
+        with lock:
+            oldpool = state.get('pool')
+            state['corpus'] = corpus
+            state['pool'] = pool
+        if oldpool is not None:
+            oldpool.close()
+        return corpus
+
+    def convert(query, licensenames, options):
+        while True:
+            with lock:
+                corpus = state['corpus']
+                pool = state['pool']
+            for licensename in licensenames:
+                if licensename not in corpus:
+                    return 404, 'application/json', json.dumps({'error': 'License %r not found' % licensename}) + '\n'
+            try:
+                result = pool.apply_async(serverconvert, (query, [corpus[licensename] for licensename in licensenames], options))
+            except ValueError:
+                # Pool closed by a concurrent reload, use the new one
+                continue
+            try:
+                contenttype, content = result.get(args.servetimeout)
+            except multiprocessing.TimeoutError:
+                return 504, 'application/json', json.dumps({'error': 'Request not converted within %d seconds' % args.servetimeout}) + '\n'
+            return 200, contenttype, content
+
+    class OSLOCRequestHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.answer()
+
+        def do_POST(self):
+            self.answer()
+
+        def answer(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = url.path.strip('/')
+            parameters = urllib.parse.parse_qs(url.query, keep_blank_values = True)
+            status = 200
+            contenttype = 'application/json'
+            try:
+                if query == 'reload':
+                    content = json.dumps(sorted(reload().keys())) + '\n'
+                elif query == 'licenses':
+                    with lock:
+                        content = json.dumps(sorted(state['corpus'].keys())) + '\n'
+                elif query in ['merge', 'checklist', 'compatibility']:
+                    licensenames = parameters.get('license', [])
+                    if len(licensenames) == 0:
+                        raise OSLOCError('No license given')
+                    options = [option for option in parameters if option != 'license']
+                    status, contenttype, content = convert(query, licensenames, options)
+                else:
+                    status = 404
+                    content = json.dumps({'error': 'Unknown request %r' % query}) + '\n'
+            except OSLOCError as e:
+                status = 400
+                content = json.dumps({'error': str(e)}) + '\n'
+            except Exception as e:
+                status = 500
+                content = json.dumps({'error': '%s: %s' % (type(e).__name__, e)}) + '\n'
+            content = content.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', contenttype)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            if verbose:
+                http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def stop(signum, frame):
+        # Worker processes forked by a reload inherit this handler
+        if os.getpid() != serverpid:
+            sys.exit(0)
+        raise KeyboardInterrupt
+
+    serverpid = os.getpid()
+
+    corpus = reload()
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', args.serve), OSLOCRequestHandler)
+    print('Serving %d licenses at http://127.0.0.1:%d/' % (len(corpus), server.server_address[1]))
+    sys.stdout.flush()
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    state['pool'].terminate()
+
+def filehash(filename):
+    """ Return the SHA-256 hash of the content of a file """
+    hashfile = open(filename, 'rb')
+    h = hashlib.sha256(hashfile.read()).hexdigest()
+    hashfile.close()
+    return h
+
+class BuildFile:
+    """ Targets of a build file, a JSON object that maps every output file to the arguments of osloc2json.py that
+        produce it, options before input files
+
+        File names are relative to the directory of the build file. The output of a target is the checklist written
+        to standard output, if the options include -r, otherwise the JSON output. Options with a value must be given
+        as "--option=value", and the output file name is not given. Inputs that are outputs of other targets are
+        built first; the targets are arranged in levels, so that the targets of a level only depend on targets of
+        previous levels. """
+
+    def __init__(self, targets):
+        if not isinstance(targets, dict):
+            raise OSLOCError('Build file is not a JSON object')
+        self.targets = {}
+        for target, arguments in targets.items():
+            if not isinstance(arguments, list) or not all(isinstance(a, str) for a in arguments):
+                raise OSLOCError('Arguments of target %r are not a list of strings' % target)
+            options = list(itertools.takewhile(lambda a: a.startswith('-'), arguments))
+            inputs = arguments[len(options):]
+            if len(inputs) == 0 or any(i.startswith('-') for i in inputs):
+                raise OSLOCError('Target %r has no input files or options after input files' % target)
+            if BuildFile.hasoption(options, 'f', 'filename'):
+                raise OSLOCError('Target %r has an output file name option' % target)
+            self.targets[target] = (options, inputs)
+        self.levels = []
+        depths = {}
+
+        def depth(target, visiting):
+            if target in depths:
+                return depths[target]
+            if target in visiting:
+                raise OSLOCError('Target %r depends on itself through its inputs' % target)
+            visiting.add(target)
+            d = 0
+            for i in self.targets[target][1]:
+                if i in self.targets:
+                    d = max(d, depth(i, visiting) + 1)
+            visiting.discard(target)
+            depths[target] = d
+            return d
+
+        for target in self.targets:
+            d = depth(target, set())
+            while len(self.levels) <= d:
+                self.levels.append([])
+            self.levels[d].append(target)
+
+    @staticmethod
+    def hasoption(options, short, long):
+        """ Return whether the options include a short option, possibly combined with others, or a long option """
+        for option in options:
+            if option == '--' + long or option.startswith('--' + long + '='):
+                return True
+            if not option.startswith('--') and short in option[1:]:
+                return True
+        return False
+
+    def rulesfilenames(self, target, builddir):
+        """ Return the paths of the rules files a target depends on, looked up as osloc2json.py does in the build directory """
+        options = self.targets[target][0]
+        rulesfilenames = []
+        for short, long, rulesfilename in [('u', 'unify', 'unifyrules.json'), ('l', 'licenseupgrade', 'licenseupgraderules.json')]:
+            if BuildFile.hasoption(options, short, long):
+                for path in [os.path.join(builddir, rulesfilename), os.path.join(builddir, '..', rulesfilename)]:
+                    if os.path.exists(path):
+                        rulesfilenames.append(path)
+                        break
+        return rulesfilenames
+
+    def key(self, target, builddir, toolversion):
+        """ Return the hash of everything the output of a target depends on: program, arguments, inputs and rules """
+        options, inputs = self.targets[target]
+        h = hashlib.sha256()
+        h.update(('%s\0%s\0' % (toolversion, '\0'.join(options + inputs))).encode('utf-8'))
+        for filename in inputs + self.rulesfilenames(target, builddir):
+            if filename in inputs:
+                filename = os.path.join(builddir, filename)
+            try:
+                h.update(('%s\0%s\0' % (os.path.basename(filename), filehash(filename))).encode('utf-8'))
+            except OSError:
+                h.update(('%s\0missing\0' % filename).encode('utf-8'))
+        return h.hexdigest()
+
+    def build(self, target, builddir):
+        """ Run osloc2json.py to build a target in a temporary directory and move the output into place, return None
+            or the messages of the failed run """
+        import shutil
+        import subprocess
+        import tempfile
+
+        options, inputs = self.targets[target]
+        recreate = BuildFile.hasoption(options, 'r', 'recreate')
+        tmpdir = tempfile.mkdtemp(prefix = '.build-', dir = builddir)
+        try:
+            arguments = list(options)
+            if len(inputs) == 1:
+                # The output file name of a single license is derived from the input file name
+                inputcopy = os.path.join(tmpdir, os.path.basename(inputs[0]))
+                shutil.copy(os.path.join(builddir, inputs[0]), inputcopy)
+                arguments.append(inputcopy)
+                outfilename = os.path.splitext(inputcopy)[0]
+                if BuildFile.hasoption(options, 'o', 'optimize'):
+                    outfilename += '-opt'
+                outfilename += '.json'
+            else:
+                outfilename = os.path.join(tmpdir, 'output.json')
+                arguments += ['-f', outfilename] + inputs
+            process = subprocess.run([sys.executable, os.path.abspath(__file__)] + arguments, cwd = builddir,
+              stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+            if process.returncode != 0 or not os.path.exists(outfilename):
+                if recreate:
+                    return process.stderr
+                return process.stdout + process.stderr
+            if recreate:
+                outfile = open(outfilename, 'w')
+                outfile.write(process.stdout)
+                outfile.close()
+            os.replace(outfilename, os.path.join(builddir, target))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors = True)
+        return None
+
+def buildtargets(buildfilenames, args):
+    """ Build the outdated targets of build files and record their keys and output hashes in a manifest next to every
+        build file, return the exit code
+
+        A target is outdated, if it has no entry in the manifest, if its key or the hash of its output has changed,
+        or if its output is missing. The outdated targets of a level are built by --jobs processes, if given. """
+    jobs = args.jobs
+    if jobs == 0:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+    toolversion = ParseCache.gettoolversion()
+    exitcode = 0
+    for buildfilename in buildfilenames:
+        buildfilename = str(buildfilename)
+        try:
+            buildfile = open(buildfilename, 'r')
+        except:
+            print('Build file %r not found' % buildfilename)
+            exitcode = 1
+            continue
+        try:
+            targets = BuildFile(json.load(buildfile))
+        except (ValueError, OSLOCError) as e:
+            print(e)
+            print('Build file %r has no valid targets, not building' % buildfilename)
+            exitcode = 1
+            continue
+        finally:
+            buildfile.close()
+        builddir = os.path.dirname(os.path.abspath(buildfilename))
+        manifestfilename = os.path.splitext(buildfilename)[0] + '.manifest.json'
+        try:
+            manifestfile = open(manifestfilename, 'r')
+            manifest = json.load(manifestfile)
+            manifestfile.close()
+        except (OSError, ValueError):
+            manifest = {}
+        manifest = {k: v for k, v in manifest.items() if k in targets.targets}
+
+        failed = set()
+        built = 0
+        for level in targets.levels:
+            outdated = []
+            for target in level:
+                if any(i in failed for i in targets.targets[target][1]):
+                    print('Target %r not built, since its input failed' % target)
+                    failed.add(target)
+                    continue
+                key = targets.key(target, builddir, toolversion)
+                outfilename = os.path.join(builddir, target)
+                entry = manifest.get(target)
+                if entry is not None and entry['key'] == key and os.path.exists(outfilename) and filehash(outfilename) == entry['output']:
+                    continue
+                if args.verbose:
+                    print('Building %r' % target)
+                outdated.append((target, key))
+            if jobs is not None and jobs > 1 and len(outdated) > 1:
+                import multiprocessing.pool
+
+                pool = multiprocessing.pool.ThreadPool(min(jobs, len(outdated)))
+                errors = pool.map(lambda t: targets.build(t[0], builddir), outdated)
+                pool.close()
+                pool.join()
+            else:
+                errors = [targets.build(target, builddir) for target, key in outdated]
+            for (target, key), error in zip(outdated, errors):
+                if error is None:
+                    manifest[target] = {'key': key, 'output': filehash(os.path.join(builddir, target))}
+                    built += 1
+                else:
+                    print(error.rstrip('\n'))
+                    print('Building target %r failed' % target)
+                    failed.add(target)
+                    exitcode = 1
+            manifestfile = open(manifestfilename, 'w')
+            json.dump(manifest, manifestfile, indent = 4, sort_keys = True)
+            manifestfile.write('\n')
+            manifestfile.close()
+        print('%d of %d targets of %r rebuilt' % (built, len(targets.targets), buildfilename))
+    return exitcode
+
+def compilevalidator(schemadata, validatorcache = None):
+    """ Return the code object of a validator of a schema, generated by fastjsonschema or taken from the validator cache """
+    import fastjsonschema
+
+    code = None
+    if validatorcache is not None:
+        key = validatorcache.key(schemadata)
+        code = validatorcache.get(key)
+    if code is None:
+        code = compile(fastjsonschema.compile_to_code(schemadata), '<validator>', 'exec')
+        if validatorcache is not None:
+            validatorcache.put(key, code)
+    return code
+
+def mkvalidator(code):
+    """ Return the validator function of a code object returned by compilevalidator() """
+    namespace = {}
+    exec(code, namespace)
+    return namespace['validate']
+
+def loadvalidator(args):
+    """ Load the OSLOC schema in the version of args and return the code object of its validator, exit if it cannot be loaded """
+    if args.v1:
+        schemafilename = 'osloc-schema-v1.json'
+    else:
+        schemafilename = 'osloc-schema.json'
+    try:
+        schema = open(schemafilename, 'r')
+    except:
+        print('Schema data file %r not opened, cannot validate' % schemafilename)
+        sys.exit(1)
+    try:
+        schemadata = json.load(schema)
+    except json.decoder.JSONDecodeError as e:
+        print(e)
+        print('Schema JSON data from file %r could not be loaded, cannot validate' % schemafilename)
+        sys.exit(1)
+    schema.close()
+    if args.nocache:
+        validatorcache = None
+    else:
+        validatorcache = ValidatorCache(args.cachedir, args.cachesize * 1024 * 1024)
+    return compilevalidator(schemadata, validatorcache)
+
+def validatelicense(licensename, data, validator):
+    """ Validate a license given as JSON object against the OSLOC schema, return the error message or None """
+    import fastjsonschema
+
+    try:
+        validator({licensename: data})
+    except fastjsonschema.JsonSchemaException as e:
+        return 'Data failed validation in license %r: %s' % (licensename, e)
+    return None
+
+def validatejsonfile(filename, validator, verbose):
+    """ Validate a JSON file for duplicate keys and against the OSLOC schema, return whether it failed and the messages to print """
+    import fastjsonschema
+
+    suffix = os.path.splitext(filename)[1]
+    if suffix != '.json':
+        return False, ['File name %r has suffix other than .json, not validating' % filename]
+    try:
+        sample = open(filename, 'r')
+    except:
+        return True, ['File %r not opened' % filename]
+    samplestr = sample.read()
+    sample.close()
+    try:
+        sampledata = json.loads(samplestr, object_pairs_hook = check_duplicates)
+    except ValueError as e:
+        return True, ["%s found in JSON file %r" % (e, filename)]
+    try:
+        validator(sampledata)
+    except fastjsonschema.JsonSchemaException as e:
+        return True, ["Data failed validation in JSON file %r: %s" % (filename, e)]
+    if verbose:
+        return False, ['File %r passed syntax and schema validation' % filename]
+    return False, []
+
+def initvalidateworker(code, verbose):
+    """ Initialize a process that validates JSON files with the marshalled code of a validator """
+    workerstate['validator'] = mkvalidator(marshal.loads(code))
+    workerstate['verbose'] = verbose
+
+def validateworker(filename):
+    return validatejsonfile(filename, workerstate['validator'], workerstate['verbose'])
+
+def validatejsonfiles(filenames, code, args):
+    """ Validate JSON files against the OSLOC schema, in --jobs processes if given, print the messages in the order of
+        the files and return the exit code """
+    jobs = args.jobs
+    if jobs == 0:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+    if jobs is not None and jobs > 1 and len(filenames) > 1:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(min(jobs, len(filenames)), initvalidateworker, (marshal.dumps(code), args.verbose))
+        results = pool.imap(validateworker, filenames, max(1, len(filenames) // (4 * jobs)))
+    else:
+        pool = None
+        validator = mkvalidator(code)
+        results = (validatejsonfile(filename, validator, args.verbose) for filename in filenames)
+    exitcode = 0
+    for failure, messages in results:
+        for message in messages:
+            print(message)
+        if failure:
+            exitcode = 1
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return exitcode
 
 def main():
     filenamehelp = 'file names of OSLOC files to process'
@@ -1103,6 +3391,7 @@ def main():
           description = 'positional arguments:   ' + filenamehelp)
         parser.add_argument = parser.add_option
         filenametype = 'string'
+        inttype = 'int'
     else:
         parser = argparse.ArgumentParser(prog = 'osloc2json.py', formatter_class = argparse.RawTextHelpFormatter,
             epilog = 'Either a single ".txt" suffixed OSLOC input file is parsed, converted to JSON format and saved under the original name with the suffix\n\
@@ -1115,6 +3404,7 @@ if specified, or (-m) all OSLOC files are parsed, merged into a single JSON obje
           nargs='+',
           help = filenamehelp)
         filenametype = pathlib.Path
+        inttype = int
     parser.add_argument('-f', '--filename',
       type = filenametype,
       metavar = 'OUTPUT',
@@ -1136,7 +3426,7 @@ if specified, or (-m) all OSLOC files are parsed, merged into a single JSON obje
     parser.add_argument('-j', '--jsonvalidate',
       action = 'store_true',
       default = False,
-      help = 'validate input files in JSON format against the OSLOC schema')
+      help = 'validate input files in JSON format against the OSLOC schema, in --jobs processes if given')
     parser.add_argument('-l', '--licenseupgrade',
       action = 'store_true',
       default = False,
@@ -1173,16 +3463,106 @@ if specified, or (-m) all OSLOC files are parsed, merged into a single JSON obje
       action = 'store_true',
       default = False,
       help = 'show names and texts the program is using')
+    parser.add_argument('--format',
+      metavar = 'FORMAT',
+      choices = JSONWriter.formats,
+      default = 'indent',
+      help = 'format of the JSON output: "indent" (default) indented by 4 spaces, "compact" without whitespace, or "jsonl" with\n\
+one license per line; an OUTPUT file name ending in ".gz", ".xz" or ".lzma" is compressed accordingly')
+    parser.add_argument('--checklistformat',
+      metavar = 'FORMAT',
+      choices = list(checklistformats),
+      default = 'checklist',
+      help = 'format of the checklist recreated with -r: "checklist" (default) in OSLOC format, "markdown" or "html" as nested list')
+    parser.add_argument('--checklistdir',
+      metavar = 'DIR',
+      default = None,
+      help = 'with -r, write the checklist of every license, of the merged license or, with --matrix, of every merged combination to\n\
+a file in DIR named after the license with the suffix ".checklist", ".md" or ".html" instead of writing it to standard output')
+    parser.add_argument('--matrix',
+      type = inttype,
+      metavar = 'SIZE',
+      default = 0,
+      help = 'merge every combination of SIZE licenses, e.g. 2 for all pairs, and store one merged license per line, default file name "matrix.jsonl"')
+    parser.add_argument('--jobs',
+      type = inttype,
+      metavar = 'N',
+      default = None,
+      help = 'number of processes that parse OSLOC files, merge combinations of licenses or answer server requests, 0 for the\n\
+number of CPUs, default number of CPUs for --matrix and --serve, otherwise 1')
+    parser.add_argument('--serve',
+      type = inttype,
+      metavar = 'PORT',
+      default = None,
+      help = 'parse the OSLOC files, or all ".txt" files of OSLOC directories, once and answer merge, checklist and compatibility\n\
+requests at http://127.0.0.1:PORT/ until interrupted, 0 for a free port that is printed at startup')
+    parser.add_argument('--servetimeout',
+      type = inttype,
+      metavar = 'SECONDS',
+      default = 60,
+      help = 'answer a server request that is not converted within SECONDS with status 504, default 60')
+    parser.add_argument('--index',
+      metavar = 'FILE',
+      default = None,
+      help = 'parse the OSLOC files, or all ".txt" files of OSLOC directories, and write an index of the licenses that have a term\n\
+below a path of tags in a use case to FILE')
+    parser.add_argument('--query',
+      metavar = 'QUERY',
+      action = 'append',
+      default = None,
+      help = 'print the licenses that match all QUERYs of the form "[USE CASE:]TAG/TAG[=TERM]", e.g. "Binary delivery:YOU MUST=Provide\n\
+Copyright notices", looked up in the index written by --index or in the index files given as OSLOC')
+    parser.add_argument('--build',
+      action = 'store_true',
+      default = False,
+      help = 'treat the OSLOC files as build files that map output files to the arguments that produce them, and rebuild the\n\
+outputs whose inputs, arguments, rules or program changed since the last build, as recorded in the ".manifest.json" file')
+    parser.add_argument('--no-cache',
+      dest = 'nocache',
+      action = 'store_true',
+      default = False,
+      help = 'do not use the cache of parsed OSLOC files and merged licenses')
+    parser.add_argument('--cachedir',
+      metavar = 'DIR',
+      default = ParseCache.defaultdir(),
+      help = 'directory of the cache of parsed OSLOC files and merged licenses, default "~/.cache/osloc2json"')
+    parser.add_argument('--cachesize',
+      type = inttype,
+      metavar = 'MB',
+      default = 64,
+      help = 'maximum size of the cache of parsed OSLOC files and merged licenses, least recently used entries are removed first, default 64')
+    parser.add_argument('--clearcache',
+      action = 'store_true',
+      default = False,
+      help = 'remove all entries from the cache of parsed OSLOC files and merged licenses')
+    parser.add_argument('--validateoutput',
+      action = 'store_true',
+      default = False,
+      help = 'validate the converted licenses against the OSLOC schema before they are written, exit with 1 if one fails')
+    parser.add_argument('--stats',
+      metavar = 'FILE',
+      help = 'write wall and CPU time of the conversion phases and calls of and nodes visited by the recursive functions to FILE\n\
+in JSON format')
+    parser.add_argument('--statsmemory',
+      action = 'store_true',
+      default = False,
+      help = 'also write the peak memory of the conversion phases traced by tracemalloc to the --stats FILE, slows down the conversion')
     if int(sys.version[0]) < 3:
         (args, filenames) = parser.parse_args()
-        if args.merge:
+        if args.matrix:
+            parser.set_defaults(filename='matrix.jsonl', merge=True)
+            (args, filenames) = parser.parse_args()
+        elif args.merge:
             parser.set_defaults(filename='merged.json')
             (args, filenames) = parser.parse_args()
         if len(filenames) < 1:
             print("error: the following arguments are required: OSLOC")
     else:
         args = parser.parse_args()
-        if args.merge:
+        if args.matrix:
+            parser.set_defaults(filename='matrix.jsonl', merge=True)
+            args = parser.parse_args()
+        elif args.merge:
             parser.set_defaults(filename='merged.json')
             args = parser.parse_args()
         filenames = args.licensefilenames
@@ -1201,66 +3581,49 @@ if specified, or (-m) all OSLOC files are parsed, merged into a single JSON obje
         splitfilenames = [dirname + s + '.txt' for s in splitfilenames]
         filenames = splitfilenames
 
-    if args.v1:
-        one = '-v1'
-    else:
-        one = ''
+    if args.clearcache:
+        ParseCache(args.cachedir, args.cachesize * 1024 * 1024).clear()
+
+    def convert():
+        if args.stats:
+            with Stats(args.statsmemory) as runstats:
+                valid = osloc2json(filenames, args.filename, json, args)
+            runstats.save(args.stats)
+            return valid
+        return osloc2json(filenames, args.filename, json, args)
+
     exitcode = 0
     if args.profiling:
         from pyinstrument import Profiler
         with Profiler(interval=0.0001) as profiler:
-            osloc2json(filenames, args.filename, json, args)
+            if not convert():
+                exitcode = 1
         profiler.print()
     else:
         if args.jsonvalidate:
-            import fastjsonschema
-
-            schemafilename = 'osloc-schema' + one + '.json'
-            try:
-                schema = open(schemafilename, 'r')
-            except:
-                print('Schema data file %r not opened, cannot validate' % schemafilename)
-                sys.exit(1)
-            try:
-                schemadata = json.load(schema)
-            except json.decoder.JSONDecodeError as e:
-                print(e)
-                print('Schema JSON data from file %r could not be loaded, cannot validate' % schemafilename)
-                sys.exit(1)
-            validator = fastjsonschema.compile(schemadata)
-            for filename in filenames:
-                failure = False
-                suffix = os.path.splitext(filename)[1]
-                if suffix != '.json':
-                    print('File name %r has suffix other than .json, not validating' % filename)
-                    continue
+            exitcode = validatejsonfiles(filenames, loadvalidator(args), args)
+        if not args.noop:
+            if args.build:
+                exitcode = max(exitcode, buildtargets(filenames, args))
+            elif args.serve is not None:
+                osloc2jsonserve(filenames, json, args)
+            elif args.matrix:
+                osloc2jsonmatrix(filenames, args.filename, json, args)
+            elif args.index is not None or args.query is not None:
                 try:
-                    sample = open(filename, 'r')
-                except:
-                    print('File %r not opened' % filename)
-                    failure = True
-                else:
-                    samplestr = sample.read()
-                    try:
-                        sampledata = json.loads(samplestr, object_pairs_hook = check_duplicates)
-                    except ValueError as e:
-                        print("%s found in JSON file %r" % (e, filename))
-                        failure = True
+                    if args.index is not None:
+                        index = osloc2jsonindex(filenames, args.index, json, args)
                     else:
-                        try:
-                            validator(sampledata)
-                        except fastjsonschema.JsonSchemaException as e:
-                            print("Data failed validation in JSON file %r: %s" % (filename, e))
-                            failure = True
-                    sample.close()
-                if failure:
+                        index = LicenseIndex()
+                        for filename in filenames:
+                            index.load(filename)
+                    if args.query is not None:
+                        querylicenses(index, args.query)
+                except OSLOCError as e:
+                    print(e)
                     exitcode = 1
-                else:
-                    if args.verbose:
-                        print('File %r passed syntax and schema validation' % filename)
-            schema.close()
-        if not args.noop:
-            osloc2json(filenames, args.filename, json, args)
+            elif not convert():
+                exitcode = 1
         if exitcode != 0:
             sys.exit(exitcode)
 